@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+# Benchmark of the data handler analysis pipeline on synthetic macropulses.
+#
+# Runs the stages of ursapqDataHandler (updateTofTraces, sliceAverage, dataFilter, getTofsAndEvs, getAxis and
+# the updateLoop body, processUpdate) over a grid of trace lenghts, slice sizes, shot numbers and
+# dtypes. For each point it reports the time and peak memory allocated by each stage, and the highest
+# train rate the handler can sustain. Results are written as JSON; the exit code is 1 if any point
+# cannot sustain --rate (10Hz by default), so that slow changes are caught before beamtime.
+#
+#   python3 dataHandler.py [--quick] [--trains N] [--out results.json]
+#
+# Traces are made by simulation.SimDoocs, the config is read from URSAPQ_CONFIG as usual
+# (default config.simulation.json) and the grid parameters override it.
+
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import io
+import platform
+import itertools
+import tracemalloc
+import numpy as np
+
+os.environ.setdefault('URSAPQ_CONFIG', 'config.simulation.json')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../Modules'))
+
+import config as configModule
+import sliceBackground
+import tofAnalysis
+import simulation
+import ursapqDataHandler
+from sharedNamespace import StatusNamespace
+
+GRID = {
+    'daqLen'    : [50000, 200000],
+    'sliceSize' : [400, 1000],
+    'shotNum'   : [100, 400],
+    'dtype'     : ['float64', 'float32'],
+}
+
+QUICK_GRID = {
+    'daqLen'    : [50000],
+    'sliceSize' : [400],
+    'shotNum'   : [100],
+    'dtype'     : ['float64'],
+}
+
+class ReplayDoocs:
+    ''' Stands in for pydoocs in the data handler, returning pre-generated macropulses '''
+    def __init__(self, source, trains, dtype):
+        self.source = source
+        self.trains = []
+        for i in range(trains):
+            train = source.getdata()[0]
+            train['data'] = train['data'].astype(dtype)
+            self.trains.append(train)
+        self.next = None
+
+    def load(self, i):
+        ''' Prepares train i for the next getdata (copied, as the handler modifies it in place) '''
+        train = self.trains[i % len(self.trains)]
+        self.next = dict(train, data=train['data'].copy())
+
+    def getdata(self):
+        return [self.next]
+
+    def read(self, address, macropulse=None):
+        return self.source.read(address, macropulse)
+
+def setConfig(**params):
+    ''' Replaces the config of the modules used by the data handler '''
+    config = configModule.config._replace(**params)
+    for module in [ursapqDataHandler, tofAnalysis, sliceBackground, simulation]:
+        module.config = config
+    return config
+
+def makeHandler(point, trains):
+    offset = 100
+    period = (point['daqLen'] - offset - point['sliceSize']) / (point['shotNum'] + 1)
+    if period < point['sliceSize']:
+        return None # Slices would overlap, not a meaningful configuration
+
+    setConfig(Data_SliceOffset=offset, Data_SlicePeriod=period, Data_SliceSize=point['sliceSize'],
+              Data_ShotNum=point['shotNum'], Data_SkipSlices=0, Data_GmdNorm=0, Sim_TrainRate=1e9)
+
+    source = simulation.SimDoocs()
+    source.connect([])
+    pds = ReplayDoocs(source, trains, point['dtype'])
+    ursapqDataHandler.pds = pds
+
+    status = StatusNamespace()
+    status.tof_retarderHV = 0
+    handler = ursapqDataHandler.ursapqDataHandler(status)
+    handler.tof_trace_daq_len = point['daqLen']
+    handler.updateFreq = 10
+    handler.timestamp = time.time() - 0.1
+    return handler, pds
+
+def stages(handler, pds):
+    ''' Returns the stages to time, as callables taking the train number '''
+    def updateTofTraces(i):
+        pds.load(i)
+        start = time.perf_counter()
+        assert handler.updateTofTraces(), "updateTofTraces failed"
+        return time.perf_counter() - start
+
+    def timed(func):
+        def run(i):
+            start = time.perf_counter()
+            func()
+            return time.perf_counter() - start
+        return run
+
+    trace = handler.tofTrace[1]
+    return {
+        'updateTofTraces': updateTofTraces,
+        'sliceAverage'   : timed(lambda: handler.sliceAverage(trace, plan='benchmark')),
+        'dataFilter'     : timed(lambda: handler.dataFilter(trace, trace)),
+        'getTofsAndEvs'  : timed(lambda: handler.getTofsAndEvs(handler.tofTrace[0])),
+        'getAxis'        : timed(lambda: handler.getAxis(handler.tofTrace[0], 0)),
+        'processUpdate'  : timed(handler.processUpdate),
+    }
+
+def runPoint(point, trains):
+    made = makeHandler(point, trains)
+    if made is None:
+        return None
+    handler, pds = made
+
+    # Warm up: first train initializes the filters and accumulators (printing the expected
+    # exceptions, hidden here), then slice plans get built
+    with contextlib.redirect_stderr(io.StringIO()):
+        pds.load(0)
+        handler.updateTofTraces()
+    for i in range(1, 3):
+        pds.load(i)
+        handler.updateTofTraces()
+    handler.processUpdate()
+
+    result = dict(point, stages={})
+    for name, stage in stages(handler, pds).items():
+        times = np.array([stage(i) for i in range(trains)])
+
+        tracemalloc.start()
+        peaks = []
+        for i in range(min(trains, 5)):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            stage(i)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+
+        result['stages'][name] = {'mean'     : times.mean(),
+                                  'p50'      : float(np.median(times)),
+                                  'max'      : times.max(),
+                                  'peakAlloc': max(peaks)}
+
+    # The DOOCS thread runs updateTofTraces for each train, the update loop runs processUpdate
+    # as often as it can. Both hold the GIL most of the time, so the sustainable rate is bounded
+    # by the sum of the two
+    perTrain = result['stages']['updateTofTraces']['mean'] + result['stages']['processUpdate']['mean']
+    result['maxRate'] = 1 / perTrain
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--quick',  action='store_true', help='run a single grid point')
+    parser.add_argument('--trains', type=int, default=30, help='trains per grid point')
+    parser.add_argument('--rate',   type=float, default=10, help='train rate that must be sustained (Hz)')
+    parser.add_argument('--out',    default='dataHandler.json', help='output JSON file')
+    args = parser.parse_args()
+
+    grid = QUICK_GRID if args.quick else GRID
+    results = []
+    for values in itertools.product(*grid.values()):
+        point = dict(zip(grid.keys(), values))
+        result = runPoint(point, args.trains)
+        if result is None:
+            print(f"{point}: skipped, slices would overlap")
+            continue
+        results.append(result)
+
+        stageTimes = '  '.join(f"{name} {stage['mean']*1e3:.2f}ms" for name, stage in result['stages'].items())
+        print(f"{point}: max {result['maxRate']:.1f} Hz | {stageTimes}")
+
+    slow = [result for result in results if result['maxRate'] < args.rate]
+    report = {'python'  : platform.python_version(),
+              'numpy'   : np.__version__,
+              'machine' : platform.machine(),
+              'date'    : time.strftime('%Y-%m-%d %H:%M:%S'),
+              'trains'  : args.trains,
+              'rate'    : args.rate,
+              'results' : results}
+
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=2, default=float)
+    print(f"Results written to {args.out}")
+
+    if slow:
+        print(f"{len(slow)} configurations cannot sustain {args.rate} Hz")
+        sys.exit(1)
+
+if __name__=='__main__':
+    main()
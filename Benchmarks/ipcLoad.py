@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+# Load benchmark of the manager status/write namespaces.
+#
+# Spawns N UrsaPQ clients, each one in its own process, with the access patterns of:
+#   console : a full status snapshot every 200ms (ursapqConsole refresh)
+#   viewer  : data_* array pulls at 10Hz (ursapqOnlineView)
+#   scan    : attribute polling at 20Hz and a write request per second (scan actions)
+# and reports p50/p99 latency of each operation, together with the manager updateStatus
+# duration and period (manager_updateDuration, manager_updatePeriod) with and without load.
+#
+# By default the manager and the data handler are started on simulated hardware
+# (config.simulation.json). With --external the clients connect to the manager of the
+# URSAPQ_CONFIG config instead. Writes request the current value of "light_enable" again: the
+# manager consumes the request and skips the PLC write, as the value does not change.
+#
+#   python3 ipcLoad.py [--consoles 15] [--viewers 2] [--scans 2] [--duration 20] [--out ipcLoad.json]
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import subprocess
+import multiprocessing
+import numpy as np
+
+localDir = os.path.dirname(os.path.abspath(__file__))
+modulesDir = os.path.join(localDir, '../Modules')
+if '--external' not in sys.argv:
+    os.environ['URSAPQ_CONFIG'] = os.path.join(modulesDir, 'config.simulation.json')
+sys.path.append(os.path.join(localDir, '../Utils'))
+
+from ursapq_api import UrsaPQ
+
+# Operations of each client type: (name, period in s, function)
+MIXES = {
+    'console': [('snapshot',            0.2,  lambda ursa: ursa.snapshot())],
+    'viewer' : [('data_shots_filtered', 0.1,  lambda ursa: ursa.data_shots_filtered),
+                ('data_axis',           0.5,  lambda ursa: ursa.data_axis),
+                ('data_tofTrace',       0.5,  lambda ursa: ursa.data_tofTrace)],
+    'scan'   : [('attribute',           0.05, lambda ursa: ursa.tof_retarderHV),
+                ('write',               1.0,  lambda ursa: setattr(ursa, 'light_enable', ursa.light_enable))],
+}
+
+def client(kind, duration, results):
+    ''' Runs the operations of a client type at their rates, reports the latencies of each '''
+    ursa = UrsaPQ()
+    ops = MIXES[kind]
+    latencies = {name: [] for name, _, _ in ops}
+    errors = {name: 0 for name, _, _ in ops}
+
+    now = time.monotonic()
+    end = now + duration
+    nextRun = [now + period * np.random.rand() for _, period, _ in ops] # Spread clients in time
+    while True:
+        i = int(np.argmin(nextRun))
+        if nextRun[i] > end:
+            break
+        time.sleep(max(nextRun[i] - time.monotonic(), 0))
+
+        name, period, func = ops[i]
+        start = time.perf_counter()
+        try:
+            func(ursa)
+            latencies[name].append(time.perf_counter() - start)
+        except Exception:
+            errors[name] += 1
+        nextRun[i] += period
+
+    results.put((kind, latencies, errors))
+
+def monitor(ursa, duration):
+    ''' Samples the manager update timing for duration seconds '''
+    durations, periods = [], []
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        status = ursa.snapshot(['manager_updateDuration', 'manager_updatePeriod'])
+        durations.append(status.manager_updateDuration)
+        periods.append(status.manager_updatePeriod)
+        time.sleep(0.1)
+    return {'updateDuration': summary(durations), 'updatePeriod': summary(periods)}
+
+def summary(values):
+    values = np.array([value for value in values if value == value]) # Drops NaN
+    if values.size == 0:
+        return {'count': 0}
+    return {'count': int(values.size),
+            'p50'  : float(np.percentile(values, 50)),
+            'p99'  : float(np.percentile(values, 99)),
+            'max'  : float(values.max())}
+
+def startServices():
+    ''' Starts manager and data handler on simulated hardware, each in its own process group '''
+    processes = []
+    for script in ['ursapqManager.py', 'ursapqDataHandler.py']:
+        processes.append(subprocess.Popen([sys.executable, script], cwd=modulesDir, start_new_session=True,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        time.sleep(2) # Data handler connects to the manager
+    return processes
+
+def connect(timeout=30):
+    ''' Waits for the manager to be up and running, and for data to be available '''
+    end = time.monotonic() + timeout
+    while True:
+        try:
+            ursa = UrsaPQ()
+            ursa.manager_updateDuration
+            ursa.data_axis
+            return ursa
+        except Exception:
+            if time.monotonic() > end:
+                raise
+            time.sleep(0.5)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--consoles', type=int, default=15)
+    parser.add_argument('--viewers',  type=int, default=2)
+    parser.add_argument('--scans',    type=int, default=2)
+    parser.add_argument('--duration', type=float, default=20, help='load duration in s')
+    parser.add_argument('--external', action='store_true', help='use a running manager')
+    parser.add_argument('--out',      default='ipcLoad.json', help='output JSON file')
+    args = parser.parse_args()
+
+    services = [] if args.external else startServices()
+    try:
+        ursa = connect()
+
+        print("Measuring idle manager...")
+        idle = monitor(ursa, 3)
+
+        print(f"Running {args.consoles} consoles, {args.viewers} viewers, {args.scans} scans for {args.duration} s...")
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=client, args=(kind, args.duration, results))
+                   for kind, count in [('console', args.consoles), ('viewer', args.viewers), ('scan', args.scans)]
+                   for i in range(count)]
+        for process in clients:
+            process.start()
+        loaded = monitor(ursa, args.duration)
+
+        latencies, errors = {}, {}
+        for process in clients:
+            kind, clientLatencies, clientErrors = results.get()
+            for name, values in clientLatencies.items():
+                latencies.setdefault(name, []).extend(values)
+                errors[name] = errors.get(name, 0) + clientErrors[name]
+        for process in clients:
+            process.join()
+    finally:
+        for process in services:
+            os.killpg(process.pid, signal.SIGTERM)
+
+    operations = {name: dict(summary(values), errors=errors[name]) for name, values in latencies.items()}
+
+    print(f"{'operation':>20} {'count':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+    for name, stats in operations.items():
+        if stats['count']:
+            print(f"{name:>20} {stats['count']:>7} {stats['p50']*1e3:>8.2f} {stats['p99']*1e3:>8.2f} {stats['max']*1e3:>8.2f} {stats['errors']:>7}")
+        else:
+            print(f"{name:>20} {0:>7} {'-':>8} {'-':>8} {'-':>8} {stats['errors']:>7}")
+    for label, stats in [('idle', idle), ('load', loaded)]:
+        duration, period = stats['updateDuration'], stats['updatePeriod']
+        if duration['count'] and period['count']:
+            print(f"manager {label}: updateStatus p50 {duration['p50']*1e3:.1f} ms, p99 {duration['p99']*1e3:.1f} ms,"
+                  f" period p50 {period['p50']*1e3:.1f} ms, p99 {period['p99']*1e3:.1f} ms")
+
+    with open(args.out, 'w') as file:
+        json.dump({'clients'   : {'consoles': args.consoles, 'viewers': args.viewers, 'scans': args.scans},
+                   'duration'  : args.duration,
+                   'operations': operations,
+                   'manager'   : {'idle': idle, 'load': loaded}}, file, indent=2)
+    print(f"Results written to {args.out}")
+
+if __name__=='__main__':
+    main()
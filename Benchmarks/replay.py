@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+# Throughput benchmark of the whole data handler on recorded trains.
+#
+# Runs ursapqDataHandler (DOOCS thread and update loop) on a local status namespace, fed by
+# macropulseReplay in 'fast' mode, looping over the recorded run. Reports the train rate of the
+# DOOCS thread, the rate of processUpdate and the data_updateFreq seen by clients. The slicing
+# config is read from URSAPQ_CONFIG as usual, set it to the config the run was recorded with.
+#
+#   python3 replay.py <records path> [--run RUN] [--duration 20] [--realtime] [--out replay.json]
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+
+os.environ.setdefault('URSAPQ_CONFIG', 'config.simulation.json')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../Modules'))
+
+import ursapqDataHandler
+from macropulseReplay import MacropulseReplay
+from sharedNamespace import StatusNamespace
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path',       help='directory of the recorded files')
+    parser.add_argument('--run',      default='*', help='run to replay, default all')
+    parser.add_argument('--duration', type=float, default=20, help='replay duration in s')
+    parser.add_argument('--realtime', action='store_true', help='replay at the recorded rate')
+    parser.add_argument('--out',      default='replay.json', help='output JSON file')
+    args = parser.parse_args()
+
+    replay = MacropulseReplay(args.path, args.run, 'realtime' if args.realtime else 'fast', loop=True)
+    ursapqDataHandler.pds = replay
+
+    status = StatusNamespace()
+    status.tof_retarderHV = 0
+    handler = ursapqDataHandler.ursapqDataHandler(status)
+
+    updates = []
+    processUpdate = handler.processUpdate
+    def timedUpdate():
+        start = time.perf_counter()
+        processUpdate()
+        updates.append(time.perf_counter() - start)
+    handler.processUpdate = timedUpdate
+
+    handler.start()
+    time.sleep(2) # Warm up: accumulators and slice plans
+    trains, updateCount, start = replay.trains, len(updates), time.monotonic()
+    time.sleep(args.duration)
+    trains, updateCount, elapsed = replay.trains - trains, len(updates) - updateCount, time.monotonic() - start
+    updateFreq = status.data_updateFreq
+    handler.stop()
+
+    durations = np.array(updates[-updateCount:]) if updateCount else np.array([np.nan])
+    result = {'python'         : platform.python_version(),
+              'numpy'          : np.__version__,
+              'machine'        : platform.machine(),
+              'date'           : time.strftime('%Y-%m-%d %H:%M:%S'),
+              'mode'           : replay.mode,
+              'duration'       : elapsed,
+              'traceLen'       : replay.traceLen,
+              'trainRate'      : trains / elapsed,
+              'updateRate'     : updateCount / elapsed,
+              'updateDuration' : {'p50': float(np.median(durations)), 'max': float(durations.max())},
+              'data_updateFreq': updateFreq,
+              'loops'          : replay.loops}
+
+    print(f"{trains} trains in {elapsed:.1f} s ({replay.loops} loops over the run), trace lenght {replay.traceLen}")
+    print(f"trains: {result['trainRate']:.1f} Hz, processUpdate: {result['updateRate']:.1f} Hz"
+          f" (p50 {result['updateDuration']['p50']*1e3:.1f} ms), data_updateFreq {updateFreq:.1f} Hz")
+
+    with open(args.out, 'w') as file:
+        json.dump(result, file, indent=2)
+    print(f"Results written to {args.out}")
+
+if __name__=='__main__':
+    main()
@@ -3,10 +3,11 @@ import time
 import context 
 from playsound import playsound
 
-while True:
-    if context.ursa.gmd_rate < 300:
+next_alarm = 0
+for gmd_rate in context.ursa.watch('gmd_rate', 10): # on every change, and every 10s if steady
+    if gmd_rate < 300 and time.time() > next_alarm:
         filepath = __file__.replace("alarm.py", "deedle_deedle.mp3") 
         playsound(filepath)
-    time.sleep(10)
+        next_alarm = time.time() + 10
 
 
@@ -4,6 +4,7 @@ from doocspie.abo import TrainAbo
 import asyncio
 import xarray as xr
 from contextlib import contextmanager
+import contextlib
 import numpy as np
 from scipy import interpolate
 
@@ -64,8 +65,11 @@ async def sdu(value):
 @action
 async def retarder(value):
     ursa.tof_retarderSetHV = -abs(value)
-    while abs(ursa.tof_retarderHV - value) > 0.3:
-        await asyncio.sleep(0.1)
+    # Wakes up on readback changes (polls without an event port), reads again at least every 0.5s
+    async with contextlib.aclosing(ursa.awatch('tof_retarderHV', 0.5)) as readbacks:
+        async for readback in readbacks:
+            if abs(readback - value) <= 0.3:
+                break
 
 @action
 def coil(value):
@@ -175,11 +179,21 @@ def get_t0():
 def set_t0(t0):
     doocspie.set(DOOCS_URSA_T0, t0)
 
+_evs_axis = None
+_evs_axis_version = None
 def calibrate_evs(data):
-    evs_axis = ursa.data_axis[1]
+    # data_axis is fetched again only when the data handler changed it
+    global _evs_axis, _evs_axis_version
+    version = ursa.data_axis_version
+    if version != _evs_axis_version:
+        _evs_axis = np.array(ursa.data_axis[1]) # Copy, may be a shared memory view
+        _evs_axis_version = version
+    evs_axis = _evs_axis
     data = data.rename(eTof='evs').assign_coords(evs=evs_axis)
     data = data.transpose(...,'evs') 
-    return data.isel(evs=slice(None, None, -1)) #reverse evs axis
+    if evs_axis[0] > evs_axis[-1]: #reverse evs axis, unless already on the eV grid (Data_Jacobian)
+        data = data.isel(evs=slice(None, None, -1))
+    return data
 
 #GMD RATE MONITOR
 UPDATE_PERIOD = 2 # seconds
@@ -205,7 +219,8 @@ def gmd_rate_monitor(data_in):
 
 #**** DATA GATERING FOR PLOTS ****
 def read_from_ursa():
-    data = ursa.data_shots_accumulator
+    # Copy, as the accumulator may be a shared memory view that gets overwritten on the next update
+    data = np.array(ursa.data_shots_accumulator)
 
     return xr.Dataset({'even':  xr.DataArray(data[0], dims=['eTof']),
                         'odd':  xr.DataArray(data[1], dims=['eTof']),
@@ -1,6 +1,10 @@
+import ctypes
 import pyads
+from pyads.errorcodes import ERROR_CODES
 from config import config
 
+ADS_NO_ERROR = ERROR_CODES[0] # Result of the successful writes of write_list_by_name
+
 class BeckhoffSys:
     '''
     This class provides a object oriented interace to the values stored in the PLC running on the
@@ -8,6 +12,11 @@ class BeckhoffSys:
 
     PLC variables are accessible as properties of this class (with either read only or r/w access)
     Note that if a variable name is changed in the PLC, the correspoding property must be adjusted here
+
+    read_multiple and write_multiple are single ADS sum commands. The connection resolves the symbol
+    information (index group/offset, size and type) of their variables once and caches it, so that
+    later calls have no name lookups. The cache is cleared by stop(), restart the connection after
+    downloading a new PLC program.
     '''
 
     def start(self):
@@ -15,8 +24,15 @@ class BeckhoffSys:
                                     config.Beckhoff_AmsPort,
                                     config.Beckhoff_IPAddr)
         self.plc.open()
+        self.notifications = [] # Handles of device notifications registered with subscribe
 
     def stop(self):
+        try:
+            for handles in self.notifications:
+                self.plc.del_device_notification(*handles)
+        except Exception:
+            pass
+        self.notifications = []
         try:
             self.plc.close()
             del self.plc
@@ -30,10 +46,37 @@ class BeckhoffSys:
         return self.plc.write_by_name(name, val, type)
 
     def read_multiple(self, names_list):
-        return self.plc.read_list_by_name(names_list)
+        ''' Reads all variables with a single ADS sum read (up to pyads.MAX_ADS_SUB_COMMANDS variables) '''
+        return self.plc.read_list_by_name(list(names_list))
 
     def write_multiple(self, names_dict):
-        self.plc.write_list_by_name(names_dict)
+        '''
+        Writes all variables with a single ADS sum write (up to pyads.MAX_ADS_SUB_COMMANDS variables).
+        Returns a dict with the ADS error of the writes rejected by the PLC, by name, empty if all succeeded
+        '''
+        if not names_dict:
+            return {}
+        results = self.plc.write_list_by_name(names_dict)
+        return {name: error for name, error in results.items() if error != ADS_NO_ERROR}
+
+    def subscribe(self, names_list, callback):
+        '''
+        Registers ADS device notifications for the variables: callback(name, value) is called
+        every time one of them changes on the PLC (and once with the initial value).
+        Callbacks run in the ADS thread, keep them short. Notifications are removed by stop().
+        '''
+        cycle = getattr(config, 'Beckhoff_NotificationCycle', 0.05)
+
+        for name in names_list:
+            plcType = self.plc.get_symbol(name).plc_type
+
+            @self.plc.notification(plcType)
+            def onChange(handle, name, timestamp, value):
+                callback(name, value)
+
+            attr = pyads.NotificationAttrib(ctypes.sizeof(plcType), pyads.ADSTRANS_SERVERONCHA,
+                                            max_delay=cycle, cycle_time=cycle)
+            self.notifications.append(self.plc.add_device_notification(name, attr, onChange))
 
 
 if __name__=='__main__':
@@ -6,35 +6,110 @@
 
 import time
 import serial
-from serial.tools import list_ports
+from concurrent.futures import ThreadPoolExecutor
+from serialPorts import portCache
 from config import config
 
+def query(port, command, timeout=None):
+    '''
+    Sends a SCPI query and returns the response line, without terminator. The power supplies echo
+    every command, echo lines are skipped, also late echoes of commands sent before without a query. Returns as soon as the response terminator arrives,
+    raises TimeoutError if it does not arrive within timeout (config.HVPS.QueryTimeout by default).
+    The port timeout is restored on return
+    '''
+    timeout = timeout or getattr(config.HVPS, 'QueryTimeout', 0.5)
+    deadline = time.monotonic() + timeout
+
+    port.reset_input_buffer() # Drops echoes of commands sent before
+    port.write(command + b'\r\n'); port.flush()
+
+    portTimeout = port.timeout
+    try:
+        while True:
+            # Each read is bounded by the time left, so that the query returns within timeout
+            port.timeout = max(deadline - time.monotonic(), 0)
+            line = port.read_until(b'\r\n')
+            if not line.endswith(b'\r\n'):
+                raise TimeoutError(f"No response from HVPS to {command}")
+            if not line.startswith((b':', b'*')): # Commands, responses are values
+                return line[:-2]
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No response from HVPS to {command}")
+    finally:
+        port.timeout = portTimeout
+
+def readValue(port, command, timeout=None):
+    ''' Sends a SCPI query and returns the value in the response, removing the unit character '''
+    return float(query(port, command, timeout)[:-1])
+
+class HVPSChannel:
+    #uses the SCPI commands to talk to power supply, read manual in /Manuals folder for explanation
+    def __init__(self, serial, chid):
+        self.serial = serial
+        self.chid = int(chid)
+
+    def on(self):
+        self.serial.write( b':VOLT ON,(@%d)' % self.chid + b'\r\n'); self.serial.flush()
+
+    def off(self):
+        self.serial.write( b':VOLT OFF,(@%d)' % self.chid + b'\r\n'); self.serial.flush()
+
+    #sets and retrives the set voltage for channel
+    @property
+    def setVoltage(self):
+        return readValue(self.serial, b':READ:VOLT?(@%d)' % self.chid)
+
+    @setVoltage.setter
+    def setVoltage(self, val):
+        self.serial.write( b':VOLT %f,(@%d)' % (float(val), self.chid) + b'\r\n'); self.serial.flush()
+
+    #retrives actual measured voltage on channel
+    @property
+    def voltage(self):
+        return readValue(self.serial, b':MEAS:VOLT?(@%d)' % self.chid)
+
 class HVPS:
     #initialize serials connection and check that serial is isOpen
 
     def __init__(self, posName = config.HVPS.Pos_Devicename,
-                       negName = config.HVPS.Neg_Devicename):
-        #init serial connection
-        self.posSerial = serial.Serial()
-        self.negSerial = serial.Serial()
+                       negName = config.HVPS.Neg_Devicename,
+                       makeSerial = serial.Serial):
+        #init serial connection (makeSerial is replaced to talk to simulated supplies, see simulation.py)
+        self.posSerial = makeSerial()
+        self.negSerial = makeSerial()
         self.posName = posName
         self.negName = negName
         self.posSerial.baudrate = 9600
-        self.posSerial.timeout = 0.02
+        self.posSerial.timeout = getattr(config.HVPS, 'QueryTimeout', 0.5) # Only bounds reads, which return on terminator
         self.negSerial.baudrate = 9600
-        self.negSerial.timeout = 0.02
+        self.negSerial.timeout = getattr(config.HVPS, 'QueryTimeout', 0.5)
 
         self._mcpEnable = False
         self._tofEnable = False
 
+        # The two supplies are independent devices, _readAll queries them in parallel.
+        # Created on first use and shut down by close()
+        self.executor = None
+
+        # Channels by name, first char of the config value is the channel num, second the supply (p/n)
+        self.channels = {}
+        for name, channel in {**config.HVPS.MCP_Channels._asdict(), **config.HVPS.TOF_Channels._asdict()}.items():
+            self.channels[name] = HVPSChannel(self.posSerial if channel[1] == 'p' else self.negSerial, channel[0])
+
     def connect(self):
-        #Scan all serials looking for matching device name
+        #Look for matching device names (cached, see serialPorts.py)
         try:
-            self.posSerial.port = list(list_ports.grep(self.posName))[0][0]
-            self.negSerial.port = list(list_ports.grep(self.negName))[0][0]
-        except IndexError:
+            posPort = portCache.find(self.posName)
+            negPort = portCache.find(self.negName)
+        except LookupError:
             raise Exception("Cannot find HVPS, is it on?")
-        
+
+        # Setting the port of an open Serial reopens it, only do it if the device changed
+        if self.posSerial.port != posPort:
+            self.posSerial.port = posPort
+        if self.negSerial.port != negPort:
+            self.negSerial.port = negPort
+
         if not self.posSerial.is_open:
             self.posSerial.open()
         if not self.negSerial.is_open:
@@ -48,6 +123,12 @@ class HVPS:
             self.posSerial.close()
         if self.negSerial.is_open:
             self.negSerial.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        # Closing is the reaction to I/O errors, the device might have moved
+        portCache.invalidate(self.posName)
+        portCache.invalidate(self.negName)
 
     @property
     def mcpEnable(self):
@@ -57,10 +138,10 @@ class HVPS:
     def mcpEnable(self, enable):
         for key,val in config.HVPS.MCP_Channels._asdict().items():
             if enable:
-                self.__getattr__(key).on()
+                self.channels[key].on()
                 self._mcpEnable = True
             else:
-                self.__getattr__(key).off()
+                self.channels[key].off()
                 self._mcpEnable = False
 
     @property
@@ -74,48 +155,56 @@ class HVPS:
 
         for key,val in config.HVPS.TOF_Channels._asdict().items():
             if enable:
-                self.__getattr__(key).on()
+                self.channels[key].on()
                 self._tofEnable = True
             else:
-                self.__getattr__(key).off()
+                self.channels[key].off()
                 self._tofEnable = False
 
+    def _channelLists(self):
+        ''' Returns [(port, names, channel numbers)] for the positive and negative power supply '''
+        channels = {**config.HVPS.MCP_Channels._asdict(), **config.HVPS.TOF_Channels._asdict()}
+        lists = []
+        for port, polarity in [(self.posSerial, 'p'), (self.negSerial, 'n')]:
+            names = [name for name, channel in channels.items() if channel[1] == polarity]
+            if names:
+                lists.append((port, names, [int(channels[name][0]) for name in names]))
+        return lists
+
+    def _readAll(self, command):
+        '''
+        Sends command with a channel list for all channels, one query per power supply.
+        The supplies are queried concurrently, so this takes the time of the slowest one
+        '''
+        def read(port, names, chids):
+            reply = query(port, command + b'(@%s)' % b','.join(b'%d' % chid for chid in chids))
+            reply = reply.split(b',')
+            if len(reply) != len(names):
+                raise ValueError(f"HVPS replied with {len(reply)} values to {command}, {len(names)} expected")
+            return {name: float(value[:-1]) for name, value in zip(names, reply)} # Removes the unit character
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='HVPS')
+        values = {}
+        futures = [self.executor.submit(read, *channelList) for channelList in self._channelLists()]
+        for future in futures:
+            values.update(future.result()) # Raises if any of the queries failed
+        return values
+
+    def voltages(self):
+        ''' Returns a dict with the measured voltage of all channels, by channel name '''
+        return self._readAll(b':MEAS:VOLT?')
+
+    def setVoltages(self):
+        ''' Returns a dict with the set voltage of all channels, by channel name '''
+        return self._readAll(b':READ:VOLT?')
+
     #returns a channel
     def __getattr__(self, channelname):
-
         try:
-            channel = getattr(config.HVPS.MCP_Channels, channelname)
-        except AttributeError:
-            channel = getattr(config.HVPS.TOF_Channels, channelname)
-
-        chid = int( channel[0] ) #first char is channel num
-        serial = self.posSerial if channel[1] == 'p' else self.negSerial
-
-        class HVPSChannel:
-            #uses the SCPI commands to talk to power supply, read manual in /Manuals folder for explanation
-            def on(self):
-                serial.write( b':VOLT ON,(@%d)' % int(chid) + b'\r\n'); serial.flush()
-
-            def off(self):
-                serial.write( b':VOLT OFF,(@%d)' % int(chid) + b'\r\n'); serial.flush()
-
-            #sets and retrives the set voltage for channel
-            @property
-            def setVoltage(self):
-                serial.write( b':READ:VOLT?(@%d)' % int(chid) + b'\r\n'); serial.flush()
-                return float (serial.readlines()[-1][:-3]) #takes last line (first line is just the command), and removes ending characters before converting to float
-
-            @setVoltage.setter
-            def setVoltage(self, val):
-                serial.write( b':VOLT %f,(@%d)' % (float(val), int(chid)) + b'\r\n'); serial.flush()
-
-            #retrives actual measured voltage on channel
-            @property
-            def voltage(self):
-                serial.write( b':MEAS:VOLT?(@%d)' % int(chid) + b'\r\n'); serial.flush()
-                return float (serial.readlines()[-1][:-3])  #takes last line (first line is just the command), and removes ending characters before converting to float
-
-        return HVPSChannel()
+            return self.__dict__['channels'][channelname]
+        except KeyError:
+            raise AttributeError(channelname)
 
 if __name__=='__main__':
     print("Running test on MeshCh")
@@ -133,3 +222,6 @@ if __name__=='__main__':
     d.Mesh.off()
     time.sleep(1)
     print(d.Mesh.voltage)
+
+    print(d.voltages())
+    print(d.setVoltages())
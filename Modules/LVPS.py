@@ -6,100 +6,160 @@
 
 import time
 import serial
-from serial.tools import list_ports
+from contextlib import contextmanager
+from serialPorts import portCache
 from config import config
 
+class LVPSChannel:
+    #uses the SCPI commands to talk to power supply, read manual in /Manuals folder for explanation
+    #commands go through the LVPS driver, which selects the output (:INST OUT<n>) only when needed
+    def __init__(self, lvps, chid):
+        self.lvps = lvps
+        self.chid = int(chid)
+
+    def on(self):
+        self.lvps.send(self.chid, b':OUTP ON')
+
+    def off(self):
+        self.lvps.send(self.chid, b':OUTP OFF')
+
+    #sets and retrives the set voltage for channel
+    @property
+    def setVoltage(self):
+        return self.lvps.query(self.chid, b':VOLT?')
+
+    @setVoltage.setter
+    def setVoltage(self, val):
+        self.lvps.send(self.chid, b':VOLT %f' % float(val))
+
+    #retrives actual measured voltage on channel
+    @property
+    def voltage(self):
+        return self.lvps.query(self.chid, b':MEAS:VOLT?')
+
+    #retrives actual measured power output on channel
+    @property
+    def power(self):
+        return self.lvps.query(self.chid, b':MEAS:POW?')
+
+    #sets and retrives the set current for channel
+    @property
+    def setCurrent(self):
+        return self.lvps.query(self.chid, b':CURR?')
+
+    @setCurrent.setter
+    def setCurrent(self, val):
+        self.lvps.send(self.chid, b':CURR %f' % float(val))
+
+    @property
+    def current(self):
+        return self.lvps.query(self.chid, b':MEAS:CURR?')
+
 class LVPS:
     #initialize serial connection and check that serial is isOpen
     #TODO: implement consistency check on device ID to prevent wrong physical power supply from being connected
-    def __init__(self, name=config.LVPS.PS_DeviceName):
-        #init serial connection
-        self.serial = serial.Serial()
+    def __init__(self, name=config.LVPS.PS_DeviceName, makeSerial=serial.Serial):
+        #init serial connection (makeSerial is replaced to talk to a simulated supply, see simulation.py)
+        self.serial = makeSerial()
         self.name = name
         self.serial.baudrate = 9600
         self.serial.timeout = 0.5
 
+        self.channels = {name: LVPSChannel(self, chid) for name, chid in config.LVPS.Channels._asdict().items()}
+
+        self.selected = None  # Output selected on the device by the last commands, None if unknown
+        self.pending = []     # Commands waiting to be sent in a single line (see batch())
+        self.batching = False
+
     def connect(self):
-        #Scan all serials looking for matching device name
-        self.serial.port = list(list_ports.grep(self.name))[0][0]
+        #Look for matching device name (cached, see serialPorts.py)
+        port = portCache.find(self.name)
+        if self.serial.port != port: # Setting the port of an open Serial reopens it
+            self.serial.port = port
         if not self.serial.is_open:
             self.serial.open()
+            self.selected = None
 
         self.serial.flush()
 
     def close(self):
         if self.serial.is_open:
             self.serial.close()
+        self.selected = None
+        self.pending = []
+        portCache.invalidate(self.name) # Closing is the reaction to I/O errors, the device might have moved
+
+    def _select(self, chid):
+        '''
+        Returns the commands needed to select output chid, none if it is already selected. The selection
+        is forgotten when the port is closed or reopened and on I/O errors or timeouts, as it is then not
+        known which commands the device got
+        '''
+        if self.selected == chid:
+            return []
+        self.selected = chid
+        return [b':INST OUT%d' % chid]
+
+    def send(self, chid, command):
+        ''' Sends a command to output chid. Inside batch() the command is queued instead '''
+        self.pending += self._select(chid) + [command]
+        if not self.batching:
+            self.flush()
+
+    def query(self, chid, command):
+        ''' Sends a query to output chid, together with any queued command, and returns the reply '''
+        self.pending += self._select(chid) + [command]
+        self.flush()
+        reply = self.serial.readline()
+        if not reply.endswith(b'\n'):
+            self.selected = None
+            raise TimeoutError(f"No response from LVPS to {command}")
+        return float(reply)
+
+    def flush(self):
+        ''' Sends all queued commands, joined with ';' in a single line '''
+        if not self.pending:
+            return
+        commands, self.pending = self.pending, []
+        try:
+            self.serial.write(b';'.join(commands) + b'\r\n'); self.serial.flush()
+        except Exception:
+            self.selected = None # Not known if the device got the command
+            raise
+
+    @contextmanager
+    def batch(self):
+        '''
+        Queues the commands sent by channels in the block, so that they are sent in one line together
+        with the next query or at the end of the block. E.g. on(), setVoltage and power take one exchange
+        '''
+        self.batching = True
+        try:
+            yield self
+        except Exception:
+            self.pending = []
+            self.selected = None # Queued selects were dropped
+            raise
+        finally:
+            self.batching = False
+        self.flush()
 
     def allOn(self):
-        for key, val in config.LVPS.Channels._asdict().items():
-            self.__getattr__(key).on()
+        with self.batch():
+            for key, val in config.LVPS.Channels._asdict().items():
+                self.channels[key].on()
 
     def allOff(self):
-        for key, val in config.LVPS.Channels._asdict().items():
-            self.__getattr__(key).off()
+        with self.batch():
+            for key, val in config.LVPS.Channels._asdict().items():
+                self.channels[key].off()
 
     #returns a channel
     def __getattr__(self, channelname):
-
-        chid = getattr(config.LVPS.Channels, channelname)
-        serial = self.serial
-
-        class LVPSChannel:
-            #uses the SCPI commands to talk to power supply, read manual in /Manuals folder for explanation
-            def on(self):
-                serial.write( b':INST OUT%d' % int(chid) + b'\r\n'); serial.flush()
-                serial.write( b':OUTP ON\r\n'); serial.flush()
-
-            def off(self):
-                serial.write( b':INST OUT%d' % int(chid) + b'\r\n'); serial.flush()
-                serial.write( b':OUTP OFF\r\n'); serial.flush()
-                
-            #sets and retrives the set voltage for channel
-            @property
-            def setVoltage(self):
-                serial.write( b':INST OUT%d' % int(chid) + b'\r\n'); serial.flush()
-                serial.write( b':VOLT?\r\n'); serial.flush()
-                return float (serial.readline())
-
-            @setVoltage.setter
-            def setVoltage(self, val):
-                serial.write( b':INST OUT%d' % int(chid) + b'\r\n'); serial.flush()
-                serial.write( b':VOLT %f' % float(val) + b'\r\n'); serial.flush()
-
-            #retrives actual measured voltage on channel
-            @property
-            def voltage(self):
-                serial.write( b':INST OUT%d' % int(chid) + b'\r\n'); serial.flush()
-                serial.write( b':MEAS:VOLT?\r\n'); serial.flush()
-                return float(serial.readline())
-
-            #retrives actual measured power output on channel
-            @property
-            def power(self):
-                serial.write( b':INST OUT%d' % int(chid) + b'\r\n'); serial.flush()
-                serial.write( b':MEAS:POW?\r\n'); serial.flush()
-                return float(serial.readline())
-
-            #sets and retrives the set current for channel
-            @property
-            def setCurrent(self):
-                serial.write( b':INST OUT%d' % int(chid) + b'\r\n'); serial.flush()
-                serial.write( b':CURR?\r\n'); serial.flush()
-                return float (serial.readline())
-
-            @setCurrent.setter
-            def setCurrent(self, val):
-                serial.write( b':INST OUT%d' % int(chid) + b'\r\n'); serial.flush()
-                serial.write( b':CURR %f' % float(val) + b'\r\n'); serial.flush()
-
-            @property
-            def current(self):
-                serial.write( b':INST OUT%d' % int(chid) + b'\r\n'); serial.flush()
-                serial.write( b':MEAS:CURR?\r\n'); serial.flush()
-                return float(serial.readline())
-
-        return LVPSChannel()
+        try:
+            return self.__dict__['channels'][channelname]
+        except KeyError:
+            raise AttributeError(channelname)
 
 if __name__=='__main__':
     d = LVPS()
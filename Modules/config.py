@@ -5,7 +5,8 @@ from collections import namedtuple
 def _json_object_hook(d): return namedtuple('X', d.keys())(*d.values())
 def json2obj(filename): return json.load(filename, object_hook=_json_object_hook)
 
+# URSAPQ_CONFIG selects another config file, relative to this folder (e.g. config.simulation.json)
 local_dir = os.path.dirname(os.path.abspath(__file__))
-file = open(local_dir + '/config.json', 'r')
+file = open(os.path.join(local_dir, os.environ.get('URSAPQ_CONFIG', 'config.json')), 'r')
 config = json2obj(file)
 file.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+# Export of status values to DOOCS properties
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import numpy as np
+import threading
+import math
+import time
+
+class DoocsExporter:
+    '''
+    Writes status values to DOOCS properties, only when they change.
+
+    properties maps each DOOCS property to (status key, deadband, relative deadband). A property is
+    written when its value differs from the last value written by more than the deadband (or the relative
+    deadband times the last value, whichever is larger), or when it was not
+    written for refreshPeriod seconds (so that a restarted DOOCS server gets all values back).
+    If the status key is None, NaN is written.
+
+    export() only queues the writes on a pool of worker threads and returns immediately. A property
+    is not queued again while its previous write is in flight. Write latency (p50/p99 of the last
+    latencyWindow writes) and failures are reported by stats(). close() waits for the queued writes,
+    the workers are started again by the next export().
+    '''
+    def __init__(self, pydoocs, properties, workers=2, refreshPeriod=60, latencyWindow=1000):
+        self.pydoocs = pydoocs
+        self.properties = properties
+        self.refreshPeriod = refreshPeriod
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+        self.last = {}      # property: (value, time) of the last successful write
+        self.inFlight = set()
+
+        self.writes = 0
+        self.skipped = 0
+        self.failures = 0
+        self.lastError = None
+        self.latency = 0
+        self.maxLatency = 0
+        self.latencies = deque(maxlen=latencyWindow) # Of the last writes, for percentiles
+
+    def keys(self):
+        ''' Status keys needed by export() '''
+        return [key for key, _, _ in self.properties.values() if key is not None]
+
+    def _changed(self, prop, value, deadband, relative, now):
+        if prop not in self.last:
+            return True
+        last, lastTime = self.last[prop]
+        if now - lastTime > self.refreshPeriod:
+            return True
+        if isinstance(value, float) and isinstance(last, float) and (math.isnan(value) or math.isnan(last)):
+            return math.isnan(value) != math.isnan(last)
+        try:
+            return abs(value - last) > max(deadband, relative * abs(last))
+        except TypeError:
+            return value != last
+
+    def export(self, status):
+        ''' Queues the writes of the properties that changed in the status dict '''
+        now = time.monotonic()
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='doocs')
+            for prop, (key, deadband, relative) in self.properties.items():
+                value = status.get(key, math.nan) if key is not None else math.nan
+                if prop in self.inFlight or not self._changed(prop, value, deadband, relative, now):
+                    self.skipped += 1
+                    continue
+                self.inFlight.add(prop)
+                self.executor.submit(self._write, prop, value)
+
+    def _write(self, prop, value):
+        start = time.monotonic()
+        try:
+            self.pydoocs.write(prop, value)
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+                self.lastError = f"{prop}: {e}"
+                self.inFlight.discard(prop)
+            return
+
+        end = time.monotonic()
+        with self.lock:
+            self.writes += 1
+            self.latency = end - start
+            self.maxLatency = max(self.maxLatency, self.latency)
+            self.latencies.append(self.latency)
+            self.last[prop] = (value, end)
+            self.inFlight.discard(prop)
+
+    def stats(self):
+        with self.lock:
+            p50, p99 = np.percentile(self.latencies, [50, 99]) if self.latencies else (math.nan, math.nan)
+            return {'writes'    : self.writes,
+                    'skipped'   : self.skipped,
+                    'failures'  : self.failures,
+                    'lastError' : self.lastError,
+                    'latency'   : self.latency,
+                    'latencyP50': float(p50),
+                    'latencyP99': float(p99),
+                    'maxLatency': self.maxLatency,
+                    'inFlight'  : len(self.inFlight)}
+
+    def close(self):
+        ''' Waits for the queued writes and stops the workers '''
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+
+# Recording of raw macropulses (TOF trace, GMD, laser trace) to disk, for offline analysis and replay.
+#
+# Records are appended to segment files of fixed size (<path>/<run>_<n>.urec) which are preallocated
+# and memory mapped. Each segment starts with SEGMENT_HEADER, followed by the records:
+#   RECORD_HEADER  : magic, macropulse, timestamp, number of arrays, record lenght (bytes, header included)
+#   for each array : ARRAY_HEADER (name, dtype, ndim, shape) and the array data, padded to 8 bytes
+# A segment ends at the first position without RECORD_MAGIC (preallocated space is zero).
+
+import os
+import glob
+import mmap
+import time
+import queue
+import struct
+import threading
+import traceback
+import numpy as np
+
+SEGMENT_MAGIC  = b'URPQREC1'
+SEGMENT_HEADER = struct.Struct('<8sI4x')        # magic, version
+RECORD_MAGIC   = b'MPLS'
+RECORD_HEADER  = struct.Struct('<4sIqdQ')       # magic, number of arrays, macropulse, timestamp, record lenght
+ARRAY_HEADER   = struct.Struct('<8s8sI4xQQ')    # name, dtype, ndim, shape (1D arrays are stored as (n, 1))
+ALIGN = 8
+
+def _padded(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+class MacropulseRecorder:
+    '''
+    Appends macropulses to memory mapped segment files from a background thread.
+
+    append() only puts the record in a queue, so the acquisition thread never waits for the disk.
+    If the queue is full (the disk cannot keep up) the record is dropped and counted. The writer
+    thread copies records to the mapped segment and flushes it every flushPeriod seconds; a new
+    segment is started when a record does not fit in the current one. Arrays passed to append
+    must not be modified afterwards.
+    '''
+    def __init__(self, path, segmentSize=1 << 30, queueSize=100, flushPeriod=1, run=None):
+        self.path = path
+        self.segmentSize = segmentSize
+        self.flushPeriod = flushPeriod
+        self.run = run or time.strftime('%Y%m%d_%H%M%S')
+        os.makedirs(path, exist_ok=True)
+
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.segmentNum = 0
+        self.segment = None
+        self.file = None
+
+        self.recorded = 0
+        self.dropped = 0
+        self.bytes = 0
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self._writeLoop, daemon=True)
+        self.thread.start()
+
+    def append(self, macropulse, timestamp, arrays):
+        ''' Queues a record. arrays is a dict of name: 2D (or 1D) array, names up to 8 characters '''
+        try:
+            self.queue.put_nowait((macropulse, timestamp, arrays))
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {'recorded': self.recorded,
+                'dropped' : self.dropped,
+                'errors'  : self.errors,
+                'bytes'   : self.bytes,
+                'queued'  : self.queue.qsize(),
+                'segment' : self.segmentName()}
+
+    def segmentName(self, num=None):
+        return os.path.join(self.path, f"{self.run}_{self.segmentNum if num is None else num:04d}.urec")
+
+    def _openSegment(self, size):
+        self.segmentNum += 1
+        self.file = open(self.segmentName(), 'w+b')
+        try:
+            os.posix_fallocate(self.file.fileno(), 0, size) # Reserve the space, a full disk would crash the mapping
+        except (AttributeError, OSError):
+            self.file.truncate(size)
+        self.segment = mmap.mmap(self.file.fileno(), size)
+        self.segment[:SEGMENT_HEADER.size] = SEGMENT_HEADER.pack(SEGMENT_MAGIC, 1)
+        self.offset = SEGMENT_HEADER.size
+        self.lastFlush = time.monotonic()
+
+    def _closeSegment(self):
+        if self.segment is None:
+            return
+        self.segment.flush()
+        self.segment.close()
+        self.file.truncate(self.offset) # Gives back the unused preallocated space
+        self.file.close()
+        self.segment = None
+
+    def _write(self, macropulse, timestamp, arrays):
+        arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+        size = RECORD_HEADER.size + sum(ARRAY_HEADER.size + _padded(array.nbytes)
+                                        for array in arrays.values())
+
+        if self.segment is None or self.offset + size + RECORD_HEADER.size > len(self.segment):
+            self._closeSegment()
+            self._openSegment(max(self.segmentSize, size + SEGMENT_HEADER.size + RECORD_HEADER.size))
+
+        # Arrays first, the record header last: a record is visible to readers only once complete
+        start = self.offset
+        offset = start + RECORD_HEADER.size
+        for name, array in arrays.items():
+            shape = array.shape if array.ndim == 2 else (array.size, 1)
+            self.segment[offset:offset + ARRAY_HEADER.size] = ARRAY_HEADER.pack(
+                name.encode('ascii'), array.dtype.str.encode('ascii'), array.ndim, *shape)
+            offset += ARRAY_HEADER.size
+            self.segment[offset:offset + array.nbytes] = array.view(np.uint8).reshape(-1)
+            offset += _padded(array.nbytes)
+        self.segment[start:start + RECORD_HEADER.size] = RECORD_HEADER.pack(
+            RECORD_MAGIC, len(arrays), macropulse, timestamp, size)
+
+        self.offset = offset
+        self.recorded += 1
+        self.bytes += size
+
+    def _writeLoop(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flushPeriod)
+            except queue.Empty:
+                record = None
+
+            if record is StopIteration:
+                self._closeSegment()
+                return
+
+            try:
+                if record is not None:
+                    self._write(*record)
+                if self.segment is not None and time.monotonic() - self.lastFlush > self.flushPeriod:
+                    self.segment.flush()
+                    self.lastFlush = time.monotonic()
+            except Exception:
+                self.errors += 1
+                traceback.print_exc()
+
+    def close(self):
+        ''' Writes all queued records and closes the segment '''
+        self.queue.put(StopIteration)
+        self.thread.join()
+
+def _records(segment, filename):
+    ''' Yields offset and header of each record in a mapped segment '''
+    magic, version = SEGMENT_HEADER.unpack_from(segment, 0)
+    if magic != SEGMENT_MAGIC:
+        raise ValueError(f"{filename} is not a macropulse record segment")
+
+    offset = SEGMENT_HEADER.size
+    while offset + RECORD_HEADER.size <= len(segment):
+        header = RECORD_HEADER.unpack_from(segment, offset)
+        if header[0] != RECORD_MAGIC:
+            return
+        yield offset, header
+        offset += header[4]
+
+def recordCount(filename):
+    ''' Number of records in a segment file, reading only the headers '''
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+            return sum(1 for _ in _records(segment, filename))
+
+def readSegment(filename, start=0, stop=None):
+    '''
+    Yields the records in a segment file as dicts (macropulse, timestamp and the arrays).
+    Only records start to stop (indices in the file) are read, the others are skipped
+    '''
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+            for i, (offset, (magic, count, macropulse, timestamp, size)) in enumerate(_records(segment, filename)):
+                if i < start:
+                    continue
+                if stop is not None and i >= stop:
+                    return
+                record = {'macropulse': macropulse, 'timestamp': timestamp}
+                position = offset + RECORD_HEADER.size
+                for _ in range(count):
+                    name, dtype, ndim, *shape = ARRAY_HEADER.unpack_from(segment, position)
+                    position += ARRAY_HEADER.size
+                    dtype = np.dtype(dtype.rstrip(b'\0').decode('ascii'))
+                    nbytes = shape[0] * shape[1] * dtype.itemsize
+                    array = np.frombuffer(segment, dtype, shape[0] * shape[1], position).copy()
+                    record[name.rstrip(b'\0').decode('ascii')] = array.reshape(shape if ndim == 2 else shape[0])
+                    position += _padded(nbytes)
+                yield record
+
+def segmentFiles(path, run='*'):
+    ''' Segment files of the runs matching run in path, in order '''
+    return sorted(glob.glob(os.path.join(path, f"{run}_*.urec")))
+
+def readRecords(path, run='*'):
+    ''' Yields all records of the runs matching run in path, in order '''
+    for filename in segmentFiles(path, run):
+        yield from readSegment(filename)
+
+if __name__=='__main__':
+    # Writes and reads back synthetic records, printing the throughput
+    import sys
+    import tempfile
+
+    trains = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as path:
+        tof = np.random.normal(size=(200000, 2))
+        recorder = MacropulseRecorder(path, segmentSize=64 << 20, queueSize=trains)
+        start = time.perf_counter()
+        for i in range(trains):
+            recorder.append(i, time.time(), {'tof': tof, 'gmd': np.ones((400, 2)), 'laser': np.empty((0, 2))})
+        queued = time.perf_counter() - start
+        recorder.close()
+        written = time.perf_counter() - start
+
+        print(f"{trains} trains, {recorder.bytes / 1e6:.0f} MB in {len(glob.glob(path + '/*.urec'))} segments")
+        print(f"append: {queued / trains * 1e6:.1f} us/train, write: {recorder.bytes / written / 1e6:.0f} MB/s, dropped {recorder.dropped}")
+
+        count = 0
+        for record in readRecords(path):
+            assert record['macropulse'] == count and record['tof'].shape == tof.shape
+            count += 1
+        print(f"read back {count} records")
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+
+# Replay of recorded macropulses (see macropulseRecorder) in place of DOOCS
+
+import time
+
+from config import config
+from macropulseRecorder import readRecords
+
+REPLAY_MODES = ('realtime', 'fast')
+MAX_TRAIN_GAP = 1 # s, longest wait between two trains in realtime mode
+
+class MacropulseReplay:
+    '''
+    Replaces the pydoocs module (connect, disconnect, getdata, read, write) in the data handler,
+    returning the trains recorded in path (runs matching run) instead of live data.
+
+    mode 'realtime' returns the trains with their recorded timestamps, paced on the time between
+    consecutive trains, capped at MAX_TRAIN_GAP so that the gaps between runs and DAQ interruptions
+    are not waited out. 'fast' returns them as fast as they are asked for, timestamped with the
+    current time so that data_updateFreq shows the rate the data handler sustains. With loop the
+    run starts over at the end, shifting macropulse numbers and timestamps so that they keep
+    increasing; otherwise getdata() returns None once all trains were replayed.
+
+    read() of the GMD and laser trace returns the data recorded with the requested macropulse,
+    the TOF trace lenght is the one of the first train. Other properties return the last written
+    value, or 0.
+    '''
+    def __init__(self, path, run='*', mode='realtime', loop=False):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"Unknown replay mode {mode}, use one of {REPLAY_MODES}")
+        self.path = path
+        self.run = run
+        self.mode = mode
+        self.loop = loop
+
+        self.records = None
+        self.connected = False
+        self.trains = 0           # Replayed trains
+        self.loops = 0            # Completed loops over the run
+        self.recent = {}          # Recent records, by (shifted) macropulse number
+        self.values = {}          # Written properties
+
+        first = next(readRecords(path, run), None)
+        if first is None:
+            raise FileNotFoundError(f"No recorded trains for run {run} in {path}")
+        self.traceLen = len(first['tof'])
+
+    def connect(self, addresses, cycles=-1):
+        self.records = readRecords(self.path, self.run)
+        self.connected = True
+        self.loops = 0
+        self.first = None         # (macropulse, timestamp) of the first train of the run
+        self.last = None          # (macropulse, timestamp) of the last train returned, before shifting
+        self.period = 0           # Time between the last two trains, capped at MAX_TRAIN_GAP
+        self.shift = (0, 0)       # Shift of macropulse and timestamp of the current loop
+        self.due = time.monotonic() # Time the next train is returned at in realtime mode
+
+    def disconnect(self):
+        self.connected = False
+        self.records = None
+
+    def _next(self):
+        ''' Returns the next recorded train, starting the run over at the end if looping '''
+        record = next(self.records, None)
+        if record is None and self.loop and self.first is not None:
+            self.loops += 1
+            # The first train follows the last one after a train period
+            self.shift = (self.shift[0] + self.last[0] - self.first[0] + 1,
+                          self.shift[1] + self.last[1] - self.first[1] + self.period)
+            self.last = None
+            self.records = readRecords(self.path, self.run)
+            record = next(self.records, None)
+        return record
+
+    def getdata(self):
+        if not self.connected:
+            return None
+        record = self._next()
+        if record is None:
+            time.sleep(0.1) # End of the replay, the data handler would spin on getdata
+            return None
+
+        if self.first is None:
+            self.first = (record['macropulse'], record['timestamp'])
+        gap = self.period if self.last is None else min(max(record['timestamp'] - self.last[1], 0), MAX_TRAIN_GAP)
+        self.last = (record['macropulse'], record['timestamp'])
+        macropulse = record['macropulse'] + self.shift[0]
+        timestamp = record['timestamp'] + self.shift[1]
+
+        if self.mode == 'realtime':
+            self.due = max(self.due + gap, time.monotonic() - MAX_TRAIN_GAP) # Does not catch up after a stall
+            time.sleep(max(self.due - time.monotonic(), 0))
+        else:
+            timestamp = time.time()
+
+        self.period = gap
+        self.trains += 1
+        self.recent[macropulse] = record
+        if len(self.recent) > 100:
+            del self.recent[next(iter(self.recent))]
+        return [{'data': record['tof'], 'macropulse': macropulse, 'timestamp': timestamp}]
+
+    def read(self, address, macropulse=None):
+        if address == config.Data_DOOCS_TOF_LEN:
+            data = self.traceLen
+        elif address in (config.Data_DOOCS_GMD, config.Data_DOOCS_LASER):
+            if macropulse is None:
+                macropulse = max(self.recent, default=None)
+            record = self.recent.get(macropulse)
+            if record is None:
+                raise Exception(f"No data for macropulse {macropulse}")
+            data = record['gmd'] if address == config.Data_DOOCS_GMD else record['laser']
+        else:
+            data = self.values.get(address, 0)
+        return {'data': data, 'macropulse': macropulse, 'timestamp': time.time()}
+
+    def write(self, address, value):
+        self.values[address] = value
+
+    def stats(self):
+        return {'trains': self.trains, 'loops': self.loops}
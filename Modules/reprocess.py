@@ -0,0 +1,177 @@
+#!/usr/bin/python
+
+# Offline reprocessing of recorded runs (see macropulseRecorder) with the analysis of the data handler.
+#
+# The trains of the run are split in chunks, which are sliced, background subtracted and summed by
+# a pool of worker processes. The partial sums are then reduced into an xarray dataset with the
+# layout of context.read_from_ursa (even, odd, gmd), normalized as set by Data_GmdNorm and rebinned
+# to the eV grid if Data_Jacobian is set, with the tof and ev axis as coordinates. With --bin the
+# trains are grouped in time bins along a 'time' dimension. Any config parameter can be changed
+# for the reprocessing with --set, e.g. to try new slicing parameters:
+#
+#   python3 reprocess.py <records path> [--run RUN] [--set Data_SliceSize=600] [--bin 10] [--retarder 0]
+#                        [--workers N] [--chunk 200] [--out run.nc]
+
+import os
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import xarray as xr
+
+import config as configModule
+import sliceBackground
+import tofAnalysis
+from macropulseRecorder import segmentFiles, recordCount, readSegment
+
+config = configModule.config
+
+def setConfig(overrides):
+    ''' Replaces the config of the analysis modules, changing the parameters in overrides '''
+    global config
+    config = configModule._json_object_hook(dict(configModule.config._asdict(), **overrides))
+    for module in [tofAnalysis, sliceBackground]:
+        module.config = config
+
+def _newBin(record):
+    return {'even': 0, 'odd': 0, 'count': 0, 'gmdEven': 0, 'gmdOdd': 0,
+            'timestamp': record['timestamp'], 'macropulse': record['macropulse']}
+
+def _addBin(total, partial):
+    for key in ['even', 'odd', 'count', 'gmdEven', 'gmdOdd']:
+        total[key] = total[key] + partial[key]
+    total['timestamp']  = min(total['timestamp'], partial['timestamp'])
+    total['macropulse'] = min(total['macropulse'], partial['macropulse'])
+
+def processChunk(filename, start, stop, binSize):
+    '''
+    Sums the average even and odd slices and the GMD of records start to stop of a segment file,
+    as the data handler does for its accumulator. Returns (bins, tof time axis, skipped trains),
+    bins being a dict of time bin: sums. Stateful backgrounds ("running") restart on each chunk.
+    '''
+    plan = None
+    background = sliceBackground.makeBackground()
+    bins = {}
+    axis = None
+    skipped = 0
+
+    for record in readSegment(filename, start, stop):
+        try:
+            tof = record['tof']
+            if config.Data_Invert:
+                tof[:,1] *= -1
+            gmd = record['gmd'][config.Data_SkipSlices:config.Data_ShotNum, 1]
+
+            plan = tofAnalysis.updateSlicePlan(plan, tof[:,1])
+            assert len(plan.gatherIdx) == gmd.size, f"GMD shot number does not match slices number"
+            even, odd = tofAnalysis.averageSlices(plan, background, tof[:,1])
+        except Exception:
+            if skipped == 0:
+                traceback.print_exc()
+            skipped += 1
+            continue
+
+        key = int(record['timestamp'] // binSize) if binSize else 0
+        if key not in bins:
+            bins[key] = _newBin(record)
+        sums = bins[key]
+        sums['even'] = sums['even'] + even
+        sums['odd']  = sums['odd']  + odd
+        sums['count']   += 1
+        sums['gmdEven'] += gmd[::2].sum()
+        sums['gmdOdd']  += gmd[1::2].sum()
+        if axis is None:
+            axis = tof[:,0].copy()
+
+    return bins, axis, skipped
+
+def toDataset(bins, axis, retarder, binned):
+    ''' Normalizes the summed bins into a dataset, in the layout of context.read_from_ursa '''
+    bins = [bins[key] for key in sorted(bins)]
+    stack = lambda key: np.array([sums[key] for sums in bins])
+    count, gmdEven, gmdOdd = stack('count'), stack('gmdEven'), stack('gmdOdd')
+    even, odd = tofAnalysis.normalizeShots(stack('even'), stack('odd'), count[:,None], gmdEven[:,None], gmdOdd[:,None])
+    tofs, evs = tofAnalysis.tofsAndEvs(axis, retarder)
+    if config.Data_Jacobian:
+        shots = tofAnalysis.rebinToEvGrid(np.vstack((even, odd)), tofs, retarder)
+        even, odd = shots[:len(bins)], shots[len(bins):]
+        tofs, evs = tofAnalysis.evGridAxis(retarder)
+
+    data = xr.Dataset({'even'  : xr.DataArray(even, dims=['time', 'eTof']),
+                       'odd'   : xr.DataArray(odd,  dims=['time', 'eTof']),
+                       'gmd'   : xr.DataArray(gmdEven + gmdOdd, dims=['time']),
+                       'trains': xr.DataArray(count, dims=['time'])},
+                      coords={'time'      : stack('timestamp'),
+                              'macropulse': ('time', stack('macropulse')),
+                              'tof'       : ('eTof', tofs),
+                              'ev'        : ('eTof', evs)})
+    return data if binned else data.isel(time=0, drop=True)
+
+def reprocess(path, run='*', overrides={}, binSize=0, retarder=0, workers=None, chunk=200):
+    '''
+    Reprocesses the runs matching run in path with the config changed by overrides.
+    binSize is the lenght in seconds of the time bins, 0 for a single bin. retarder is the retarder
+    voltage for the ev axis (it is not recorded). Returns the dataset and the number of skipped trains
+    '''
+    setConfig(overrides)
+    tasks = [(filename, start, min(start + chunk, count), binSize)
+             for filename in segmentFiles(path, run)
+             for count in [recordCount(filename)]
+             for start in range(0, count, chunk)]
+    if not tasks:
+        raise FileNotFoundError(f"No recorded trains for run {run} in {path}")
+
+    bins, axis, skipped = {}, None, 0
+    with ProcessPoolExecutor(workers, initializer=setConfig, initargs=(overrides,)) as executor:
+        for chunkBins, chunkAxis, chunkSkipped in executor.map(processChunk, *zip(*tasks)):
+            for key, sums in chunkBins.items():
+                if key in bins:
+                    _addBin(bins[key], sums)
+                else:
+                    bins[key] = sums
+            axis = chunkAxis if axis is None else axis
+            skipped += chunkSkipped
+
+    if not bins:
+        raise ValueError(f"All {skipped} trains were skipped, check the slicing config")
+    data = toDataset(bins, axis, retarder, binSize > 0)
+    data.attrs.update(path=os.path.abspath(path), run=run, retarder=retarder,
+                      config=json.dumps(config._asdict()), skipped=skipped)
+    return data, skipped
+
+def parseOverride(text):
+    ''' KEY=VALUE, VALUE as JSON if possible (numbers, lists), as a string otherwise '''
+    key, _, value = text.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path',       help='directory of the recorded files')
+    parser.add_argument('--run',      default='*', help='run to reprocess, default all')
+    parser.add_argument('--set',      action='append', default=[], type=parseOverride, metavar='KEY=VALUE',
+                        help='config parameter to change, can be repeated')
+    parser.add_argument('--bin',      type=float, default=0, help='time bins in s, default a single bin')
+    parser.add_argument('--retarder', type=float, default=0, help='retarder voltage for the ev axis')
+    parser.add_argument('--workers',  type=int, default=None, help='worker processes, default all cores')
+    parser.add_argument('--chunk',    type=int, default=200, help='trains per chunk')
+    parser.add_argument('--out',      default=None, help='output netCDF file')
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    data, skipped = reprocess(args.path, args.run, dict(args.set), args.bin, args.retarder, args.workers, args.chunk)
+    elapsed = time.monotonic() - start
+
+    trains = int(data.trains.sum())
+    print(data)
+    print(f"{trains} trains in {elapsed:.1f} s ({trains / elapsed:.0f} trains/s), {skipped} skipped")
+    if args.out:
+        data.to_netcdf(args.out)
+        print(f"Results written to {args.out}")
+
+if __name__=='__main__':
+    main()
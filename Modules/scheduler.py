@@ -0,0 +1,145 @@
+#!/usr/bin/python
+
+# Fixed rate scheduler for the periodic tasks of the manager (HV/LV power supplies, DOOCS export)
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import traceback
+import heapq
+import time
+
+class ScheduledTask:
+    '''
+    A function called every <period> seconds by the Scheduler, with its timing statistics.
+    Ticks are on a fixed grid (start + n*period) of the monotonic clock, so the period does not
+    drift with the execution time of the task.
+
+    latency : delay between the scheduled tick and the actual start of the task
+    jitter  : deviation of the interval between two consecutive starts from the period
+    overruns: ticks skipped because the previous run of the task was still going
+    '''
+    def __init__(self, name, func, period):
+        self.name = name
+        self.func = func
+        self.period = period
+        self.running = False
+        self.next = None
+
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.lastStart = None
+        self.latency = 0
+        self.maxLatency = 0
+        self.jitter = 0
+        self.maxJitter = 0
+        self.duration = 0
+        self.maxDuration = 0
+
+    def run(self, tick):
+        start = time.monotonic()
+        self.latency = start - tick
+        self.maxLatency = max(self.maxLatency, self.latency)
+        if self.lastStart is not None:
+            self.jitter = abs(start - self.lastStart - self.period)
+            self.maxJitter = max(self.maxJitter, self.jitter)
+        self.lastStart = start
+
+        try:
+            self.func()
+        except Exception:
+            self.errors += 1
+            print(f"Scheduled task {self.name} failed:")
+            print(traceback.format_exc())
+        finally:
+            self.duration = time.monotonic() - start
+            self.maxDuration = max(self.maxDuration, self.duration)
+            self.runs += 1
+            self.running = False
+
+    def stats(self):
+        return {'period'     : self.period,
+                'runs'       : self.runs,
+                'errors'     : self.errors,
+                'overruns'   : self.overruns,
+                'latency'    : self.latency,
+                'maxLatency' : self.maxLatency,
+                'jitter'     : self.jitter,
+                'maxJitter'  : self.maxJitter,
+                'duration'   : self.duration,
+                'maxDuration': self.maxDuration}
+
+class Scheduler:
+    '''
+    Runs tasks at fixed rates from a single timing thread, on a bounded pool of worker threads.
+    A task is never run twice at the same time: if it is still running when its next tick comes,
+    the tick is skipped and counted as an overrun. Ticks missed because the scheduler fell behind
+    are skipped as well, tasks are not run in bursts to catch up.
+
+    Tasks must be added before start(). stop() waits for running tasks to complete.
+    '''
+    def __init__(self, workers=4):
+        self.workers = workers
+        self.tasks = {}
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def add(self, name, func, period):
+        self.tasks[name] = ScheduledTask(name, func, period)
+
+    def start(self):
+        self.stopEvent.clear()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scheduler')
+
+        now = time.monotonic()
+        self.queue = []
+        for i, task in enumerate(self.tasks.values()):
+            task.next = now
+            task.running = False
+            task.lastStart = None
+            heapq.heappush(self.queue, (task.next, i, task))
+
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            self.executor.shutdown(wait=True)
+
+    def stats(self):
+        ''' Returns a dict with the timing statistics of each task '''
+        return {name: task.stats() for name, task in self.tasks.items()}
+
+    def _loop(self):
+        while True:
+            tick, i, task = self.queue[0]
+            if self.stopEvent.wait(max(tick - time.monotonic(), 0)):
+                return
+
+            if task.running:
+                task.overruns += 1
+            else:
+                task.running = True
+                self.executor.submit(task.run, tick)
+
+            # Next tick on the grid, skipping the ones already in the past
+            now = time.monotonic()
+            task.next = tick + task.period
+            if task.next <= now:
+                task.next += (int((now - task.next) / task.period) + 1) * task.period
+            heapq.heapreplace(self.queue, (task.next, i, task))
+
+if __name__=='__main__':
+    # Runs a fast task and a task slower than its period for a few seconds and prints the stats
+    scheduler = Scheduler(2)
+    scheduler.add('fast', lambda: time.sleep(0.001), 0.01)
+    scheduler.add('slow', lambda: time.sleep(0.15), 0.1)
+    scheduler.start()
+    time.sleep(3)
+    scheduler.stop()
+
+    for name, stats in scheduler.stats().items():
+        print(name, {k: round(v, 4) for k, v in stats.items()})
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+# Discovery of serial devices by name, shared by the HVPS and LVPS drivers.
+
+import threading
+from serial.tools import list_ports
+
+class PortCache:
+    '''
+    Caches the device path of serial ports found with list_ports.grep, so that drivers can call
+    find() on every connect without rescanning all serial devices.
+
+    The cache must be invalidated when the port stops working (drivers do it in close(), which
+    the manager calls after I/O errors). If pyudev is installed, the cache is also cleared
+    on every hotplug event of a tty device.
+    '''
+    def __init__(self):
+        self.ports = {}
+        self.lock = threading.Lock()
+        self.observer = None
+
+    def find(self, name):
+        ''' Returns the device path of the first port matching name, raises LookupError if there is none '''
+        with self.lock:
+            if self.observer is None:
+                self._startMonitor()
+
+            port = self.ports.get(name)
+            if port is None:
+                try:
+                    port = self.ports[name] = list(list_ports.grep(name))[0][0]
+                except IndexError:
+                    raise LookupError(f"No serial device matching {name}")
+            return port
+
+    def invalidate(self, name=None):
+        ''' Forgets the port of name, or all ports if name is None '''
+        with self.lock:
+            if name is None:
+                self.ports.clear()
+            else:
+                self.ports.pop(name, None)
+
+    def _startMonitor(self):
+        try:
+            import pyudev
+        except ImportError: # Without hotplug events, invalidation on errors is enough
+            self.observer = False
+            return
+
+        monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        monitor.filter_by('tty')
+        self.observer = pyudev.MonitorObserver(monitor, callback=lambda device: self.invalidate(), daemon=True)
+        self.observer.start()
+
+portCache = PortCache()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+# Publication of numpy arrays to local clients through shared memory.
+# The status namespace only carries a small metadata dict for each array, clients on the
+# same host map the array directly (see Utils/ursapq_api.py, which must agree on the layout below).
+
+import os
+import numpy as np
+from multiprocessing import shared_memory
+
+# Each shared memory segment starts with a header, followed by the array data.
+# The header holds the sequence number of the data in the segment as an uint64,
+# which is 0 while the segment is being written. Padded to keep the data aligned.
+HEADER_SIZE = 64
+
+class SharedArrayRing:
+    '''
+    Ring of shared memory segments holding successive versions of an array with fixed
+    shape and dtype. Each write goes to the next segment, so that a client mapping the
+    previous version has (slots - 1) update periods to use it before it is overwritten.
+    '''
+    def __init__(self, name, shape, dtype, slots):
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.seq = 0
+
+        size = HEADER_SIZE + max(int(np.prod(shape)) * self.dtype.itemsize, 1)
+        self.segments = [shared_memory.SharedMemory(f"{name}_{i}", create=True, size=size) for i in range(slots)]
+        self.headers  = [np.ndarray((1,), '<u8', buffer=seg.buf) for seg in self.segments]
+        self.arrays   = [np.ndarray(shape, self.dtype, buffer=seg.buf, offset=HEADER_SIZE) for seg in self.segments]
+
+    def write(self, array):
+        ''' Copies array in the next segment and returns the metadata clients need to map it '''
+        self.seq += 1
+        slot = self.seq % len(self.segments)
+
+        self.headers[slot][0] = 0 # Mark as being written
+        self.arrays[slot][...] = array
+        self.headers[slot][0] = self.seq
+
+        return {'shm'  : self.segments[slot].name,
+                'seq'  : self.seq,
+                'shape': self.shape,
+                'dtype': self.dtype.str}
+
+    def close(self):
+        # Views on the buffers must be released before the segments can be closed
+        self.headers = []
+        self.arrays = []
+        for seg in self.segments:
+            seg.close()
+            seg.unlink()
+        self.segments = []
+
+class SharedArrayPublisher:
+    '''
+    Publishes arrays by key. Each key gets its own ring of segments, which is
+    reallocated (with a new name) when the shape or dtype of the array changes.
+    '''
+    def __init__(self, prefix='ursapq', slots=3):
+        self.prefix = f"{prefix}_{os.getpid()}"
+        self.slots = slots
+        self.rings = {}
+        self.generation = 0
+
+    def publish(self, key, array):
+        ''' Writes array to shared memory and returns the metadata to put in the status namespace '''
+        array = np.asarray(array)
+        ring = self.rings.get(key)
+
+        if ring is None or ring.shape != array.shape or ring.dtype != array.dtype:
+            if ring is not None:
+                ring.close()
+            self.generation += 1
+            ring = SharedArrayRing(f"{self.prefix}_{key}_{self.generation}", array.shape, array.dtype, self.slots)
+            self.rings[key] = ring
+
+        return ring.write(array)
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
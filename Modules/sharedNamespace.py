@@ -0,0 +1,222 @@
+#!/usr/bin/python
+
+# Namespaces shared by the manager through multiprocessing.managers, with their proxies.
+# Utils/ursapq_api.py defines the client side proxy, keep the exposed methods in sync.
+
+from multiprocessing.managers import Namespace, NamespaceProxy
+from multiprocessing.connection import Listener
+import threading
+import traceback
+import queue
+import math
+import time
+
+def _changed(old, new):
+    ''' Returns True if a status value changed. Arrays are always considered changed '''
+    if hasattr(new, '__array__'):
+        return True
+    if isinstance(old, float) and isinstance(new, float) and math.isnan(old) and math.isnan(new):
+        return False
+    try:
+        return bool(old != new)
+    except Exception:
+        return True
+
+SUBSCRIBED = 'subscribed' # Sent to a client once its subscription is registered
+
+class _Subscriber:
+    ''' A client connection of StatusPublisher, with its own queue and sending thread '''
+    def __init__(self, conn, keys, maxQueue):
+        self.conn = conn
+        self.keys = keys
+        self.queue = queue.Queue(maxsize=maxQueue)
+        self.closed = False
+        self.queue.put(SUBSCRIBED) # First message, so every event published after it reaches the client
+        threading.Thread(target=self._sendLoop, daemon=True).start()
+
+    def put(self, event):
+        ''' Queues an event, returns False if the queue is full (client not reading) '''
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None) # Wakes up the sending thread
+        except queue.Full:
+            pass
+        self.conn.close()
+
+    def _sendLoop(self):
+        while not self.closed:
+            event = self.queue.get()
+            if event is None:
+                return
+            try:
+                self.conn.send(event)
+            except Exception: # Client is gone, dropped by the publisher on the next event
+                self.closed = True
+                return
+
+class StatusPublisher:
+    '''
+    Pushes status change events to subscribed clients through a multiprocessing.connection socket.
+    Clients connect, send the list of keys they are interested in (None for all keys except the
+    data_* analysis outputs, as snapshot()), receive SUBSCRIBED once registered, and then
+    (key, value, timestamp, seq) tuples for each change. Events of data_* keys have no value (None),
+    as these are large arrays updated with every train: clients read them when they need them.
+
+    Runs in the manager server process, the threads are started on the first published event.
+    Each client has its own queue of maxClientQueue events and sending thread, so that a slow
+    client does not delay the others: a client whose queue is full (it stopped reading) is
+    disconnected. Events are dropped if the main queue is full.
+    '''
+    def __init__(self, address, authkey, maxQueue=10000, maxClientQueue=1000):
+        self.address = address
+        self.authkey = authkey
+        self.maxClientQueue = maxClientQueue
+        self.events = queue.Queue(maxsize=maxQueue)
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        self.started = True
+        try:
+            self.listener = Listener(self.address, authkey=self.authkey)
+        except Exception: # Events are not pushed, but status updates must go on
+            traceback.print_exc()
+            return
+        threading.Thread(target=self._acceptLoop, daemon=True).start()
+        threading.Thread(target=self._dispatchLoop, daemon=True).start()
+
+    def publish(self, events):
+        if not self.started:
+            self.start()
+        for event in events:
+            try:
+                self.events.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def _acceptLoop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+                if not conn.poll(5):
+                    conn.close()
+                    continue
+                keys = conn.recv()
+                with self.lock:
+                    self.subscribers.append(_Subscriber(conn, None if keys is None else set(keys),
+                                                        self.maxClientQueue))
+            except Exception:
+                traceback.print_exc()
+
+    def _dispatchLoop(self):
+        while True:
+            event = self.events.get()
+            with self.lock:
+                subscribers = list(self.subscribers)
+
+            key = event[0]
+            for subscriber in subscribers:
+                wanted = key in subscriber.keys if subscriber.keys is not None else not key.startswith('data_')
+                if not wanted:
+                    continue
+                if subscriber.closed or not subscriber.put(event): # Client is gone or not reading
+                    subscriber.close()
+                    with self.lock:
+                        self.subscribers.remove(subscriber)
+
+class StatusNamespace(Namespace):
+    '''
+    Status namespace. On top of plain attribute access, allows reading and writing
+    many values in a single request (snapshot() and update()). These run under a lock in
+    the manager process, so a snapshot never sees half of an update.
+
+    If a StatusPublisher is given, every change of a value is pushed to subscribed clients.
+    '''
+    def __init__(self, publisher=None):
+        self.__dict__['_lock'] = threading.Lock()
+        self.__dict__['_publisher'] = publisher
+        self.__dict__['_seq'] = 0
+
+    def _set(self, values):
+        ''' Sets values and publishes the ones that changed. Must hold the lock '''
+        events = []
+        now = time.time()
+        for key, value in values.items():
+            if self._publisher is not None and (key not in self.__dict__ or _changed(self.__dict__[key], value)):
+                self.__dict__['_seq'] += 1
+                events.append((key, None if key.startswith('data_') else value, now, self._seq))
+            self.__dict__[key] = value
+
+        if events:
+            self._publisher.publish(events)
+
+    def __setattr__(self, key, value):
+        with self._lock:
+            self._set({key: value})
+
+    def __delattr__(self, key):
+        with self._lock:
+            del self.__dict__[key]
+
+    def snapshot(self, keys=None):
+        '''
+        Returns a dict with the current value of keys (missing keys are skipped).
+        If keys is None, returns all values except the data_* analysis outputs, which can be
+        large arrays and must be requested explicitly
+        '''
+        with self._lock:
+            if keys is None:
+                return {k: v for k, v in self.__dict__.items() if not k.startswith(('_', 'data_'))}
+            return {k: self.__dict__[k] for k in keys if k in self.__dict__}
+
+    def update(self, values):
+        ''' Sets all values in the dict at once '''
+        with self._lock:
+            self._set(values)
+
+class StatusProxy(NamespaceProxy):
+    _exposed_ = ('__getattribute__', '__setattr__', '__delattr__', 'snapshot', 'update')
+
+    def snapshot(self, keys=None):
+        return self._callmethod('snapshot', (keys,))
+
+    def update(self, values):
+        return self._callmethod('update', (values,))
+
+class WriteRequests(Namespace):
+    '''
+    Namespace for client write requests. Clients set attributes as usual, the manager
+    collects all pending requests at once with drain(). Only the last write of each key is kept.
+    '''
+    def __init__(self):
+        self.__dict__['_lock'] = threading.Lock()
+
+    def __setattr__(self, key, value):
+        with self._lock:
+            self.__dict__[key] = value
+
+    def __delattr__(self, key):
+        with self._lock:
+            del self.__dict__[key]
+
+    def drain(self):
+        ''' Returns a dict with all pending requests and removes them '''
+        with self._lock:
+            requests = {k: v for k, v in self.__dict__.items() if not k.startswith('_')}
+            for key in requests:
+                del self.__dict__[key]
+        return requests
+
+class WriteProxy(NamespaceProxy):
+    _exposed_ = ('__getattribute__', '__setattr__', '__delattr__', 'drain')
+
+    def drain(self):
+        return self._callmethod('drain')
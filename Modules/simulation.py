@@ -0,0 +1,402 @@
+#!/usr/bin/python
+
+# Simulated hardware, used instead of the real one when the "Simulation" config option is set.
+# Allows running ursapqManager.py and ursapqDataHandler.py away from the experiment, e.g. with
+#   URSAPQ_CONFIG=config.simulation.json python3 ursapqManager.py
+#
+# Provided backends:
+#   SimBeckhoffSys      : PLC symbol table in memory, replaces Beckhoff.BeckhoffSys
+#   SimHVPS / SimLVPS   : HVPS/LVPS drivers talking SCPI to simulated supplies through pseudo terminals (SimSerial)
+#   SimDoocs            : replaces the pydoocs module, generates TOF, GMD and laser traces at 10Hz
+#
+# The simulated devices are simple, they are meant to give the control loops and the analysis
+# something realistic to work on, not to model the setup.
+
+import os
+import re
+import math
+import time
+import threading
+import numpy as np
+import serial
+
+from config import config
+from HVPS import HVPS
+from LVPS import LVPS
+
+class SimOven:
+    '''
+    Thermal model of the sample oven, shared by the simulated LVPS (heating power) and
+    PLC (body temperature). Temperature relaxes to ambient + gain*power with time constant tau.
+    '''
+    def __init__(self, ambient=25, gain=10, tau=60):
+        self.ambient = ambient
+        self.gain = gain
+        self.tau = tau
+        self.power = 0
+        self.temperature = ambient
+        self.lastUpdate = time.monotonic()
+
+    def update(self):
+        now = time.monotonic()
+        dt, self.lastUpdate = now - self.lastUpdate, now
+        target = self.ambient + self.gain * self.power
+        self.temperature += (target - self.temperature) * (1 - math.exp(-dt / self.tau))
+        return self.temperature
+
+oven = SimOven()
+
+# Initial values of the PLC variables, all others start at 0
+PLC_DEFAULTS = {
+    'MAIN.Chamber_Pressure'  : 2e-8,
+    'MAIN.PreVac_Pressure'   : 1e-3,
+    'MAIN.PreVac_OK'         : True,
+    'MAIN.MainVac_OK'        : True,
+    'MAIN.TurboPump_ON'      : True,
+    'MAIN.Turbo_NO'          : True,
+    'MAIN.TurboMain_Freq'    : 1000,
+    'MAIN.PreVacValves_Open' : True,
+    'MAIN.LVPS_ON'           : True,
+    'MAIN.GasLine_Pressure'  : 1.0,
+    'MAIN.Sample_CapTemp'    : 250,
+    'MAIN.Sample_TipTemp'    : 250,
+    'MAIN.Sample_BodyTemp'   : 250,
+    'MAIN.Magnet_Temp'       : 250,
+    'MAIN.Pumps_Enable'      : True,
+}
+
+class SimBeckhoffSys:
+    '''
+    Same interface as Beckhoff.BeckhoffSys, on a symbol table in memory.
+    Every ADS command takes Sim_AdsLatency seconds (default 2ms). Between commands the
+    variables evolve: axes move to their set point, the flow follows its set point and
+    drives the chamber pressure, the coil current follows the output and temperatures
+    follow the oven model.
+    '''
+    def __init__(self):
+        self.values = dict(PLC_DEFAULTS)
+        self.lock = threading.Lock()
+        self.latency = getattr(config, 'Sim_AdsLatency', 0.002)
+        self.lastStep = time.monotonic()
+        self.notifyStop = threading.Event()
+
+    def start(self):
+        self.notifyStop.clear()
+
+    def stop(self):
+        self.notifyStop.set()
+
+    def _step(self):
+        ''' Updates the simulated variables. Must hold the lock '''
+        now = time.monotonic()
+        dt, self.lastStep = now - self.lastStep, now
+        v = self.values
+
+        for axis in ['SampleX', 'SampleY', 'SampleZ', 'MagnetY', 'FrameX', 'FrameY']:
+            pos = v.get(f'MAIN.{axis}.NcToPlc.ActPos', 0)
+            if v.get(f'MAIN.{axis}_MotionEnable') and not v.get(f'MAIN.{axis}_MotionStop'):
+                delta = v.get(f'MAIN.{axis}_SetPoint', 0) - pos
+                pos += math.copysign(min(abs(delta), dt), delta) # 1 mm/s
+            v[f'MAIN.{axis}.NcToPlc.ActPos'] = pos
+
+        flowSet = v.get('MAIN.Sample_Flow_Set', 0) if v.get('MAIN.GasLine_Enable') else 0
+        flow = v.get('MAIN.Sample_Flow', 0)
+        v['MAIN.Sample_Flow'] = flow + (flowSet - flow) * (1 - math.exp(-dt))
+        v['MAIN.Chamber_Pressure'] = 2e-8 + 1e-7 * v['MAIN.Sample_Flow']
+
+        v['MAIN.Coil_Curr_In'] = v.get('MAIN.Coil_Curr_Out', 0) if v.get('MAIN.Coil_Enable') else 0
+
+        temperature = oven.update()
+        v['MAIN.Sample_BodyTemp'] = int(temperature * 10)
+        v['MAIN.Sample_CapTemp']  = int((temperature - 5) * 10)
+        v['MAIN.Sample_TipTemp']  = int((temperature + 5) * 10)
+
+    def _command(self):
+        time.sleep(self.latency)
+        self._step()
+
+    def read(self, name, type=None):
+        with self.lock:
+            self._command()
+            return self.values.get(name, 0)
+
+    def write(self, name, val, type=None):
+        with self.lock:
+            self._command()
+            self.values[name] = val
+
+    def read_multiple(self, names_list):
+        with self.lock:
+            self._command()
+            return {name: self.values.get(name, 0) for name in names_list}
+
+    def write_multiple(self, names_dict):
+        if not names_dict:
+            return {}
+        with self.lock:
+            self._command()
+            self.values.update(names_dict)
+        return {}
+
+    def subscribe(self, names_list, callback):
+        ''' Calls callback(name, value) on changes, checking every Beckhoff_NotificationCycle seconds '''
+        names = list(names_list)
+        cycle = getattr(config, 'Beckhoff_NotificationCycle', 0.05)
+
+        def notify():
+            last = {}
+            while not self.notifyStop.wait(cycle):
+                with self.lock:
+                    self._step()
+                    values = {name: self.values.get(name, 0) for name in names}
+                for name, value in values.items():
+                    if name not in last or last[name] != value:
+                        last[name] = value
+                        callback(name, value)
+
+        threading.Thread(target=notify, daemon=True).start()
+
+class SimSerial(serial.Serial):
+    '''
+    serial.Serial connected to a simulated device through a pseudo terminal: the device answers on
+    the master side in a background thread, the driver uses the slave side as a real port, so that
+    reads, timeouts and buffers behave as with pyserial on the hardware. The reply to each line is
+    written after Sim_SerialLatency seconds plus the transfer time at the baudrate.
+    '''
+    def __init__(self, device):
+        self.simDevice = device
+        self.latency = getattr(config, 'Sim_SerialLatency', 0.005)
+        # The slave is kept open, so that the master does not get EIO while the driver has closed the port
+        self.master, self.slave = os.openpty()
+        super().__init__()
+        self.port = os.ttyname(self.slave)
+        threading.Thread(target = self._serve, daemon = True).start()
+
+    def _serve(self):
+        buffer = b''
+        while True:
+            buffer += os.read(self.master, 4096)
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                reply = self.simDevice.handle(line + b'\n')
+                time.sleep(self.latency + (len(line) + 1 + len(reply)) * 10 / self.baudrate)
+                if reply:
+                    os.write(self.master, reply)
+
+class SimHVPSDevice:
+    '''
+    Simulated HV supply in the dialect used by HVPS.py: every command line is echoed, voltages
+    are replied with a unit, channel lists (@a,b,c) get comma separated replies
+    '''
+    def __init__(self, channels=10):
+        self.setVoltage = [0.0] * channels
+        self.enabled = [False] * channels
+
+    def handle(self, data):
+        reply = b''
+        for line in data.split(b'\r\n'):
+            if not line:
+                continue
+            reply += line + b'\r\n'
+            answer = self.command(line)
+            if answer is not None:
+                reply += answer + b'\r\n'
+        return reply
+
+    def command(self, line):
+        query = re.fullmatch(rb':(MEAS|READ):VOLT\?\(@([\d,]+)\)', line)
+        if query:
+            channels = [int(ch) for ch in query.group(2).split(b',')]
+            if query.group(1) == b'MEAS':
+                values = [self.setVoltage[ch] * self.enabled[ch] + np.random.normal(0, 0.05) for ch in channels]
+            else:
+                values = [self.setVoltage[ch] for ch in channels]
+            return b','.join(b'%.5EV' % value for value in values)
+
+        enable = re.fullmatch(rb':VOLT (ON|OFF),\(@(\d+)\)', line)
+        if enable:
+            self.enabled[int(enable.group(2))] = enable.group(1) == b'ON'
+            return None
+
+        setVoltage = re.fullmatch(rb':VOLT ([-+\d.eE]+),\(@(\d+)\)', line)
+        if setVoltage:
+            self.setVoltage[int(setVoltage.group(2))] = float(setVoltage.group(1))
+        return None
+
+class SimLVPSDevice:
+    '''
+    Simulated LV supply in the dialect used by LVPS.py: no echo, an output is selected with
+    :INST OUT<n> and commands can be chained with ';'. Outputs drive a 10 Ohm load, the
+    output connected to the oven heats it (see SimOven)
+    '''
+    def __init__(self, ovenOutput, outputs=4, load=10):
+        self.ovenOutput = ovenOutput
+        self.load = load
+        self.selected = 1
+        self.setVoltage = [0.0] * (outputs + 1)
+        self.setCurrent = [1.0] * (outputs + 1)
+        self.enabled = [False] * (outputs + 1)
+
+    def _output(self, n):
+        voltage = self.setVoltage[n] if self.enabled[n] else 0
+        current = min(voltage / self.load, self.setCurrent[n])
+        return current * self.load, current
+
+    def handle(self, data):
+        reply = b''
+        for line in data.split(b'\r\n'):
+            answers = [self.command(command.strip()) for command in line.split(b';') if command.strip()]
+            answers = [answer for answer in answers if answer is not None]
+            if answers:
+                reply += b';'.join(answers) + b'\n'
+
+        oven.update()
+        voltage, current = self._output(self.ovenOutput)
+        oven.power = voltage * current
+        return reply
+
+    def command(self, command):
+        n = self.selected
+        voltage, current = self._output(n)
+
+        if command.startswith(b':INST OUT'):
+            self.selected = int(command[len(b':INST OUT'):])
+        elif command == b':OUTP ON':
+            self.enabled[n] = True
+        elif command == b':OUTP OFF':
+            self.enabled[n] = False
+        elif command == b':VOLT?':
+            return b'%.3f' % self.setVoltage[n]
+        elif command.startswith(b':VOLT '):
+            self.setVoltage[n] = float(command[len(b':VOLT '):])
+        elif command == b':CURR?':
+            return b'%.3f' % self.setCurrent[n]
+        elif command.startswith(b':CURR '):
+            self.setCurrent[n] = float(command[len(b':CURR '):])
+        elif command == b':MEAS:VOLT?':
+            return b'%.3f' % voltage
+        elif command == b':MEAS:CURR?':
+            return b'%.3f' % current
+        elif command == b':MEAS:POW?':
+            return b'%.3f' % (voltage * current)
+        return None
+
+class SimHVPS(HVPS):
+    ''' HVPS driver connected to two simulated supplies '''
+    def __init__(self):
+        super().__init__(makeSerial=lambda: SimSerial(SimHVPSDevice()))
+
+    def connect(self):
+        for port in (self.posSerial, self.negSerial):
+            if not port.is_open:
+                port.open()
+
+class SimLVPS(LVPS):
+    ''' LVPS driver connected to a simulated supply, with the oven on the Oven output '''
+    def __init__(self):
+        super().__init__(makeSerial=lambda: SimSerial(SimLVPSDevice(int(config.LVPS.Channels.Oven))))
+
+    def connect(self):
+        if not self.serial.is_open:
+            self.serial.open()
+            self.selected = None
+
+class SimDoocs:
+    '''
+    Replaces the pydoocs module (connect, disconnect, getdata, read, write) for the properties used
+    by the data handler and the manager. getdata() returns a new macropulse every 1/Sim_TrainRate
+    seconds (default 10Hz) with a TOF trace of Data_ShotNum shots laid out according to the slicing
+    config: a baseline, noise and a photoline whose height follows the GMD, higher on even
+    (pumped) shots. read() of the GMD for a macropulse returns the values used for its trace.
+    Other properties return the last written value, or 0.
+    '''
+    def __init__(self):
+        self.rate = getattr(config, 'Sim_TrainRate', 10)
+        self.rng = np.random.default_rng()
+        self.connected = False
+        self.macropulse = 0
+        self.nextTrain = time.monotonic()
+        self.gmd = {}     # GMD of the recent macropulses, by macropulse number
+        self.values = {}  # Written properties
+
+        # Trace layout: room for all shots and a full slice after the last one
+        self.traceLen = int(math.ceil(config.Data_SliceOffset + (config.Data_ShotNum + 1) * config.Data_SlicePeriod
+                                      + config.Data_SliceSize))
+        self.sampleTime = getattr(config, 'Sim_SampleTime', 0.0005) # us
+        self.axis = np.arange(self.traceLen) * self.sampleTime
+
+        # Photoline shape of a single shot, placed at 30% of the slice
+        samples = np.arange(config.Data_SliceSize)
+        self.peak = np.exp(-0.5 * ((samples - 0.3 * config.Data_SliceSize) / 5) ** 2)
+        self.shotStart = (config.Data_SliceOffset + np.arange(config.Data_ShotNum) * config.Data_SlicePeriod).astype(int)
+
+    def connect(self, addresses, cycles=-1):
+        self.connected = True
+        self.nextTrain = time.monotonic()
+
+    def disconnect(self):
+        self.connected = False
+
+    def _train(self):
+        ''' Generates the next macropulse '''
+        self.macropulse += 1
+        gmd = np.abs(self.rng.normal(50, 10, config.Data_ShotNum))
+        self.gmd[self.macropulse] = gmd
+        self.gmd.pop(self.macropulse - 100, None)
+
+        trace = self.rng.normal(0, 0.01, self.traceLen) + 0.05
+        amplitude = gmd / 50 * np.where(np.arange(config.Data_ShotNum) % 2 == 0, 1.2, 1.0)
+        for start, height in zip(self.shotStart, amplitude):
+            trace[start:start + config.Data_SliceSize] -= height * self.peak # MCP signal is negative
+
+        return {'data'       : np.column_stack((self.axis, trace)),
+                'macropulse' : self.macropulse,
+                'timestamp'  : time.time()}
+
+    def getdata(self):
+        if not self.connected:
+            return None
+        time.sleep(max(self.nextTrain - time.monotonic(), 0))
+        self.nextTrain = max(self.nextTrain + 1 / self.rate, time.monotonic() - 1 / self.rate)
+        return [self._train()]
+
+    def read(self, address, macropulse=None):
+        if address == config.Data_DOOCS_TOF_LEN:
+            data = self.traceLen
+        elif address == config.Data_DOOCS_GMD:
+            gmd = self.gmd.get(macropulse if macropulse is not None else self.macropulse)
+            if gmd is None:
+                raise Exception(f"No data for macropulse {macropulse}")
+            data = np.column_stack((np.arange(gmd.size), gmd))
+        elif address == config.Data_DOOCS_LASER:
+            t = np.arange(1000)
+            data = np.column_stack((t, np.exp(-0.5 * ((t - 200) / 20) ** 2)))
+        else:
+            data = self.values.get(address, 0)
+        return {'data': data, 'macropulse': macropulse or self.macropulse, 'timestamp': time.time()}
+
+    def write(self, address, value):
+        self.values[address] = value
+
+if __name__=='__main__':
+    # Quick check of the simulated devices through the real drivers
+    hvps = SimHVPS()
+    hvps.connect()
+    hvps.tofEnable = True
+    hvps.Retarder.setVoltage = 100
+    print("HVPS set  :", hvps.setVoltages())
+    print("HVPS meas :", hvps.voltages())
+
+    lvps = SimLVPS()
+    lvps.connect()
+    with lvps.batch():
+        lvps.Oven.on()
+        lvps.Oven.setVoltage = 5
+        print("Oven power:", lvps.Oven.power)
+
+    doocs = SimDoocs()
+    doocs.connect([config.Data_DOOCS_TOF])
+    start = time.monotonic()
+    for i in range(10):
+        train = doocs.getdata()[0]
+    print(f"10 trains in {time.monotonic() - start:.2f} s, trace shape {train['data'].shape}")
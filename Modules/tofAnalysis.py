@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+# Analysis of TOF traces shared by the data handler (online) and reprocess (offline):
+# slicing of macropulses into single shots, GMD normalization, TOF to eV conversion and
+# rebinning to a uniform eV grid. Parameters are read from the Data_* config.
+
+import functools
+import numpy as np
+from config import config
+
+M_OVER_E = 5.69
+
+class SlicePlan:
+    '''
+    Precomputed gather indices used to chop a macropulse trace into single shot slices.
+    Only the slices between Data_SkipSlices and Data_ShotNum are gathered, so that
+    even shots are the even rows of the output and odd shots the odd rows.
+
+    Building the plan is relatively expensive, so it is cached by the data handler and
+    rebuilt only when the slicing parameters or the trace lenght/dtype change (see key()).
+    '''
+    def __init__(self, traceLen, dtype, offset, period, size, skip, shotNum):
+        self.params = self.key(traceLen, dtype, offset, period, size, skip, shotNum)
+
+        #Calculate chopping points for slicing, skipping unused slices
+        sliceStartIdx = np.arange(offset, traceLen - period, period).astype(int)
+        sliceStartIdx = sliceStartIdx[skip:shotNum]
+
+        self.gatherIdx = sliceStartIdx[:, None] + np.arange(size)
+        if self.gatherIdx.size and self.gatherIdx.max() >= traceLen:
+            raise ValueError("Check slicing config, slices extend past the end of the trace")
+        self.sliceCount = shotNum - skip
+        self.even = slice(0, None, 2)
+        self.odd  = slice(1, None, 2)
+
+        # Output buffer for gather(), reused on every call
+        self.buffer = np.empty(self.gatherIdx.shape, dtype=dtype)
+
+    @staticmethod
+    def key(traceLen, dtype, offset, period, size, skip, shotNum):
+        return (traceLen, np.dtype(dtype), offset, period, size, skip, shotNum)
+
+    def gather(self, trace):
+        ''' Returns the stacked slices of trace. Output is overwritten by the next call '''
+        # Indices are checked in __init__, mode='clip' avoids buffering in np.take
+        return np.take(trace, self.gatherIdx, out=self.buffer, mode='clip')
+
+def updateSlicePlan(plan, tofTrace):
+    ''' Returns plan if it matches tofTrace and the slicing config, otherwise a new SlicePlan '''
+    params = (len(tofTrace), tofTrace.dtype,
+              config.Data_SliceOffset, config.Data_SlicePeriod, config.Data_SliceSize,
+              config.Data_SkipSlices, config.Data_ShotNum)
+
+    if plan is None or plan.params != SlicePlan.key(*params):
+        plan = SlicePlan(*params)
+    return plan
+
+def averageSlices(plan, background, tofTrace):
+    '''
+    Slices tofTrace with plan, subtracts the baseline given by background (see sliceBackground)
+    from each slice and returns the average of the even and of the odd slices
+    '''
+    stackedTraces = plan.gather(tofTrace)
+
+    bg = background(stackedTraces)
+    stackedTraces -= bg[:,None]
+
+    evenSlice = stackedTraces[plan.even]
+    oddSlice  = stackedTraces[plan.odd]
+    assert evenSlice.shape == oddSlice.shape, f"Check slicing config, unequal number of even and odd slices"
+
+    return evenSlice.mean(axis=0), oddSlice.mean(axis=0)
+
+def normalizeShots(even, odd, count, gmdEven, gmdOdd):
+    ''' Divides the sums of count even and odd shots by their GMD if Data_GmdNorm is set, by count otherwise '''
+    if config.Data_GmdNorm:
+        return even / gmdEven, odd / gmdOdd
+    return even / count, odd / count
+
+def tof2eV(tof, retard, bottleLenght=None):
+    ''' converts time of flight into ectronvolts '''
+    s = bottleLenght or config.Data_BottleLenght
+
+    # UNITS AND ORDERS OF MAGNITUDE DO CHECK OUT
+    return 0.5 * M_OVER_E * ( s / tof )**2 - retard
+
+def eV2tof(ev, retard, bottleLenght=None):
+    ''' converts electronvolts into time of flight, NaN below the retarder '''
+    s = bottleLenght or config.Data_BottleLenght
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return s * np.sqrt(0.5 * M_OVER_E / (np.asarray(ev) + retard))
+
+def tofsAndEvs(tofAxis, retard):
+    ''' TOF and eV axis of a slice, from the time axis of the macropulse trace '''
+    #Generate tof times and eV data
+    tofs = tofAxis[:config.Data_SliceSize] - tofAxis[0]
+
+    #avoid 0tof, leads to +inf eV
+    tofs += config.Data_eTof_start
+
+    #Generate EV from TOF
+    return tofs, tof2eV(tofs, retard)
+
+def evGrid():
+    ''' Uniform eV grid set by Data_EvGrid, as (start, stop, step): bins of step eV from start to stop '''
+    start, stop, step = getattr(config, 'Data_EvGrid', (0, 500, 0.5))
+    return start, stop, step
+
+def _gridEdges(grid):
+    start, stop, step = grid
+    return start + step * np.arange(int(round((stop - start) / step)) + 1)
+
+@functools.lru_cache(maxsize=16)
+def rebinMatrix(retard, eTofStart, bottleLenght, sliceSize, sampleTime, grid):
+    '''
+    Sparse (grid points x sliceSize) matrix moving the signal of each TOF sample into the bins of the
+    uniform eV grid (start, stop, step), in proportion to the overlap of the eV interval covered by
+    the sample with each bin. The signal in each bin is then proportional to the spectrum in eV,
+    so this is also the Jacobian correction. Cached, as it only changes with the retarder voltage
+    and the axis parameters.
+    '''
+    import scipy.sparse # Only needed with Data_Jacobian
+
+    gridEdges = _gridEdges(grid)
+
+    # eV interval covered by each TOF sample, between the midpoints with its neighbours
+    tofEdges = eTofStart + sampleTime * (np.arange(sliceSize + 1) - 0.5)
+    tofEdges[0] = eTofStart # avoids 0 and negative tof, leading to +inf eV
+    evEdges = tof2eV(tofEdges, retard, bottleLenght)
+    high, low = evEdges[:-1], evEdges[1:] # eV decreases with tof
+
+    # Grid bins overlapping each sample: first and last (included), none if outside of the grid
+    first = np.clip(np.searchsorted(gridEdges, low, 'right') - 1, 0, None)
+    last  = np.clip(np.searchsorted(gridEdges, high, 'left') - 1, None, len(gridEdges) - 2)
+    counts = np.clip(last - first + 1, 0, None)
+
+    samples = np.repeat(np.arange(sliceSize), counts)
+    bins = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    overlap = (np.minimum(high[samples], gridEdges[bins + 1]) - np.maximum(low[samples], gridEdges[bins]))
+    weights = overlap / (high - low)[samples]
+
+    keep = weights > 0
+    return scipy.sparse.csr_matrix((weights[keep], (bins[keep], samples[keep])),
+                                   shape=(len(gridEdges) - 1, sliceSize))
+
+def evGridAxis(retard):
+    ''' TOF and eV of the centers of the eV grid bins. TOF is NaN if the retarder voltage is unknown (NaN) '''
+    edges = _gridEdges(evGrid())
+    evs = (edges[:-1] + edges[1:]) / 2
+    return eV2tof(evs, retard), evs
+
+def rebinToEvGrid(shots, tofs, retard):
+    '''
+    Rebins shots (one per row, on the tofs axis of tofsAndEvs) to the uniform eV grid with a single
+    sparse product. The rebinned shots are NaN if the retarder voltage is unknown (NaN)
+    '''
+    grid = tuple(evGrid())
+    if not np.isfinite(retard):
+        return np.full((len(shots), len(_gridEdges(grid)) - 1), np.nan)
+
+    # Rounded, so that the noise of the retarder readback and of the ADC time axis does not rebuild the matrix
+    retard = round(float(retard), 1)
+    sampleTime = float(f"{tofs[1] - tofs[0]:.9g}")
+    matrix = rebinMatrix(retard, config.Data_eTof_start, config.Data_BottleLenght, len(tofs), sampleTime, grid)
+    return (matrix @ np.asarray(shots).T).T
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 from multiprocessing.managers import BaseManager, Namespace, NamespaceProxy
+from sharedNamespace import StatusProxy
 from datetime import datetime
 from collections import namedtuple
 import threading
@@ -8,35 +9,58 @@ import traceback
 import math
 import time
 import numpy as np
-import pydoocs as pds
 
 from config import config
+
+# Recorded trains (see macropulseRecorder) or simulated DOOCS, to run the data handler without the experiment
+if getattr(config, 'Data_Replay', ''):
+    from macropulseReplay import MacropulseReplay
+    pds = MacropulseReplay(config.Data_Replay,
+                           run  = getattr(config, 'Data_ReplayRun', '*'),
+                           mode = getattr(config, 'Data_ReplayMode', 'realtime'),
+                           loop = getattr(config, 'Data_ReplayLoop', False))
+elif getattr(config, 'Simulation', False):
+    from simulation import SimDoocs
+    pds = SimDoocs()
+else:
+    import pydoocs as pds
+from sliceBackground import makeBackground
+from tofAnalysis import (SlicePlan, updateSlicePlan, averageSlices, normalizeShots, tof2eV, tofsAndEvs,
+                         evGrid, evGridAxis, rebinToEvGrid)
+from sharedArrays import SharedArrayPublisher
+from macropulseRecorder import MacropulseRecorder
 import time
 
 #  "Data_DOOCS_TOF"      : "FLASH.FEL/SPDEVDMA/FL2EXP1.O/CH00.ZMQ", 
 
 
 class ursapqDataHandler:
-    def __init__(self):
+    def __init__(self, status=None):
         '''
         Connects to the manager and uploads processed data for online display.
         Data is taken from doocs and processed here for fast display and analysis
 
         One thread reads data from doocs the other processes the data and uploads
         it to clients
+
+        If status is given (e.g. a local sharedNamespace.StatusNamespace), it is used
+        instead of connecting to the manager. Used by the benchmarks.
         ''' 
         
         self.port = config.UrsapqServer_Port
         self.authkey = config.UrsapqServer_AuthKey.encode('ascii')
 
-        #Setup multiprocessing manager
-        class statusManager(BaseManager): pass
-        statusManager.register('getStatusNamespace', proxytype=NamespaceProxy)
-        self.manager = statusManager(('', self.port), self.authkey)
+        if status is not None:
+            self.status = status
+        else:
+            #Setup multiprocessing manager
+            class statusManager(BaseManager): pass
+            statusManager.register('getStatusNamespace', proxytype=StatusProxy)
+            self.manager = statusManager(('', self.port), self.authkey)
 
-        # Shared system status namespace
-        self.manager.connect()
-        self.status = self.manager.getStatusNamespace()
+            # Shared system status namespace
+            self.manager.connect()
+            self.status = self.manager.getStatusNamespace()
 
         # Init analyis parameters from config file they are not present already
         self.status.data_filterTau = config.Data_FilterTau   # Tau in seconds of the low pass filter on evenShots and oddShots
@@ -50,6 +74,23 @@ class ursapqDataHandler:
 
         self.stopEvent = threading.Event() #Event is set to stop all background threads
 
+        # If enabled, output arrays are published through shared memory and only their
+        # metadata goes in the status namespace (see publish)
+        if getattr(config, 'Data_SharedMemory', False):
+            self.sharedArrays = SharedArrayPublisher()
+        else:
+            self.sharedArrays = None
+
+        # If enabled, raw trains are appended to disk for offline analysis and replay
+        if getattr(config, 'Data_Record', False):
+            self.recorder = MacropulseRecorder(getattr(config, 'Data_RecordPath', 'records'),
+                                               segmentSize = getattr(config, 'Data_RecordSegmentSize', 1 << 30),
+                                               queueSize   = getattr(config, 'Data_RecordQueue', 100))
+        else:
+            self.recorder = None
+        self.rawTrain = None #Unprocessed data of the last train, for the recorder
+        self.threads = []
+
         # Data
         self.dataUpdated  = threading.Event() #Event is set every time new data is available
         self.updateFreq = 0
@@ -58,7 +99,18 @@ class ursapqDataHandler:
         self.tofTrace = None
         self.gmd = None #Rate of gmd in uJ / s, filtered
         self.laserTrace = np.empty((2,2)) #empty data for when laser trace cannot be read from DOOCS
+        self.laserMacropulse = None #Macropulse of laserTrace
         self.triggTrace = None
+
+        self.slicePlans = {} #Cached slice indices, one per caller, see getSlicePlan
+
+        # Memoized data_axis, see getAxis
+        self.axis = None
+        self.axisKey = None
+        self.axisRetard = None      #Retarder voltage of the axis, None if unknown (NaN)
+        self.axisVersion = int(time.time() * 1000) #Starts from the time in ms, so that versions do not repeat across restarts
+        self.publishedAxisVersion = None
+        self.backgrounds = {} #Background estimators, one per caller as some keep state across trains
         
     def start(self):
         '''
@@ -67,17 +119,38 @@ class ursapqDataHandler:
         '''
         self.stopEvent.clear()
         pds.connect([config.Data_DOOCS_TOF], cycles=-1)
-        threading.Thread(target = self.doocsUpdateLoop).start()
-        threading.Thread(target = self.updateLoop).start()
-
         self.tof_trace_daq_len = pds.read(config.Data_DOOCS_TOF_LEN)['data'] #Get set value for TRACE->DAQ lenght
 
+        self.threads = [threading.Thread(target = self.doocsUpdateLoop),
+                        threading.Thread(target = self.updateLoop)]
+        for thread in self.threads:
+            thread.start()
+
     def stop(self):
         '''
-        Tells background threads to stop
+        Tells background threads to stop and waits for them, so that the last train is
+        recorded before the recorder and the shared memory are closed
         '''
         self.stopEvent.set()
+        self.dataUpdated.set() #Wakes up updateLoop so that it sees the stop event
         pds.disconnect()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        if self.sharedArrays is not None:
+            self.sharedArrays.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def publish(self, values):
+        '''
+        Writes the dict of output values to the status namespace in a single update.
+        Arrays go through shared memory if Data_SharedMemory is set, so that they are not
+        pickled through the manager
+        '''
+        if self.sharedArrays is not None:
+            values = {key: self.sharedArrays.publish(key, val) if isinstance(val, np.ndarray) else val
+                      for key, val in values.items()}
+        self.status.update(values)
 
     def dataFilter(self, newData, oldData):
         '''
@@ -110,6 +183,11 @@ class ursapqDataHandler:
         except Exception as error:
             traceback.print_exc()
             return False
+
+        #Keep a copy of the raw data for the recorder, as traces are modified in place below
+        if self.recorder is not None:
+            self.rawTrain = (newTof['macropulse'], newTof['timestamp'],
+                             newTof['data'].copy(), newGmd['data'].copy())
         
         #CHOP trace so that it maches DAQ:
         newTof['data'] = newTof['data'][:self.tof_trace_daq_len,:]
@@ -131,15 +209,24 @@ class ursapqDataHandler:
             self.tofTrace  = newTof['data'].T.copy()
             self.gmd = newGmd['data'][:,1].copy()
 
-        #Accumulate data:
+        #Accumulate data, sliced and background subtracted train by train so that
+        #the accumulators only hold SliceSize samples regardless of trace lenght
+        try:
+            evenShot, oddShot, _ = self.sliceAverage(newTof['data'][:,1], plan='accumulator')
+        except Exception as error:
+            traceback.print_exc()
+            return False
+
         try:
-            self.tof_accumulator[1] += newTof['data'][:,1] 
             self.accumulator_count += 1
+            self.even_accumulator += evenShot
+            self.odd_accumulator  += oddShot
             self.gmd_even_accum += newGmd['data'][::2,1].sum()
             self.gmd_odd_accum  += newGmd['data'][1::2,1].sum()
         except Exception as error:
             traceback.print_exc()
-            self.tof_accumulator  = newTof['data'].T.copy() #Rest tof accumulator
+            self.even_accumulator = evenShot.astype(float) #Reset accumulators
+            self.odd_accumulator  = oddShot.astype(float)
             self.accumulator_count = 1
             self.gmd_even_accum = newGmd['data'][::2,1].sum()
             self.gmd_odd_accum  = newGmd['data'][1::2,1].sum()
@@ -149,6 +236,7 @@ class ursapqDataHandler:
         try:
             self.laserTrace = pds.read(config.Data_DOOCS_LASER, 
                                                 macropulse = self.macropulse)['data'].T                 
+            self.laserMacropulse = self.macropulse
         except Exception as error:
             traceback.print_exc()
 
@@ -158,65 +246,83 @@ class ursapqDataHandler:
         '''
         #Run until stop event
         while not self.stopEvent.is_set():
-            if not self.updateTofTraces():
-                continue
-            if config.Data_ReadLaser:
+            self.rawTrain = None
+            updated = self.updateTofTraces()
+            # Trains are recorded once fetched, also if slicing failed, to be reprocessed offline
+            fetched = self.rawTrain is not None
+            if config.Data_ReadLaser and (updated or fetched):
                 self.updateLaserTrace()
+            if fetched:
+                self.recordTrain()
             # Notify filter worker that new data is available
-            self.dataUpdated.set()
+            if updated:
+                self.dataUpdated.set()
+
+    def recordTrain(self):
+        ''' Queues the raw data of the last train to the recorder, never waits for the disk '''
+        macropulse, timestamp, tof, gmd = self.rawTrain
+        # Empty if the laser trace of this train could not be read
+        laser = self.laserTrace.T if config.Data_ReadLaser and self.laserMacropulse == macropulse else np.empty((0,2))
+        self.recorder.append(macropulse, timestamp, {'tof': tof, 'gmd': gmd, 'laser': laser})
             
     def Tof2eV(self, tof, retard):
         ''' converts time of flight into ectronvolts '''
-        # Constants for conversion:
-        s = config.Data_BottleLenght
-        m_over_e = 5.69
-
-        # UNITS AND ORDERS OF MAGNITUDE DO CHECK OUT
-        return 0.5 * m_over_e * ( s / tof )**2 - retard
+        return tof2eV(tof, retard)
 
-    def stack_slices(self, array, startIdx, sliceLen):
-        all_idx = startIdx[:, None] + np.arange(sliceLen)
-        return array[all_idx]
+    def getSlicePlan(self, tofTrace, name):
+        ''' 
+            Returns the slice plan for tofTrace, rebuilding it if the slicing parameters changed.
+            Each name gets its own plan (and output buffer), so that different threads can slice
+            at the same time
+        '''
+        plan = self.slicePlans[name] = updateSlicePlan(self.slicePlans.get(name), tofTrace)
+        return plan
         
-    def sliceAverage(self, tofTrace):
+    def sliceAverage(self, tofTrace, plan='lowpass'):
         ''' 
             Get a long tof trace, slices it in pieces and returns the 
             average of the even and odd slices.
-            Gmd normalization if gmdTrace is given 
+            plan selects which cached slice plan to use (see getSlicePlan)
         '''
-        #Calculate chopping points for slicing
-        sliceStartIdx  = np.arange(config.Data_SliceOffset, 
-                                    len(tofTrace)-config.Data_SlicePeriod, 
-                                   config.Data_SlicePeriod).astype(int)
-                         
-        stackedTraces = self.stack_slices(tofTrace, sliceStartIdx, config.Data_SliceSize)                      
-        
-        #Sikp traces
-        numTraces = stackedTraces.shape[0]
-        start = config.Data_SkipSlices
-        end   = config.Data_ShotNum    
-                                 
-        bg = np.percentile(stackedTraces, 10, axis=1)
-        stackedTraces -= bg[:,None]                                
-                                 
-        #Sum up all slices skipping the first self.skipSlices
-        evenSlice = stackedTraces[start:end:2]
-        oddSlice  = stackedTraces[start+1:end:2]
-        assert evenSlice.shape == oddSlice.shape, f"Check slicing config, unequal number of even and odd slices"
-        assert evenSlice.shape[0] == self.gmd.size/2, f"GMD shot number does not match slices number"
-
-        return evenSlice.mean(axis=0), oddSlice.mean(axis=0), end-start                        
+        if plan not in self.backgrounds:
+            self.backgrounds[plan] = makeBackground()
+        background = self.backgrounds[plan]
+
+        plan = self.getSlicePlan(tofTrace, plan)
+        assert len(plan.gatherIdx) == self.gmd.size, f"GMD shot number does not match slices number"
+
+        evenShot, oddShot = averageSlices(plan, background, tofTrace)
+        return evenShot, oddShot, plan.sliceCount
     
-    def getTofsAndEvs(self, tofAxis):
-        #Generate tof times and eV data
-        tofs = tofAxis[:config.Data_SliceSize] - tofAxis[0]
+    def getTofsAndEvs(self, tofAxis, retard=None):
+        if retard is None:
+            retard = self.status.tof_retarderHV
+        return tofsAndEvs(tofAxis, retard)
 
-        #avoid 0tof, leads to +inf eV
-        tofs += config.Data_eTof_start
+    def getAxis(self, tofAxis, retard):
+        '''
+        Returns data_axis and its version. The axis is computed again only when the retarder voltage
+        changes by more than Data_AxisTolerance (default 0.05V) or the axis parameters change, and then
+        the version is increased, so that clients fetch data_axis only when data_axis_version changes.
+        Also sets sliceTofs, the TOF axis of the slices (not of the eV grid) for rebinning
+        '''
+        key = (len(tofAxis), tofAxis[0], tofAxis[-1], config.Data_SliceSize, config.Data_eTof_start,
+               config.Data_BottleLenght, config.Data_Jacobian, tuple(evGrid()))
+        retard = retard if math.isfinite(retard) else None
+        tolerance = getattr(config, 'Data_AxisTolerance', 0.05)
 
-        #Generate EV from TOF
-        evs = self.Tof2eV( tofs, self.status.tof_retarderHV )    
-        return tofs, evs 
+        if (self.axis is None or key != self.axisKey or (retard is None) != (self.axisRetard is None)
+                or (retard is not None and abs(retard - self.axisRetard) > tolerance)):
+            hv = math.nan if retard is None else retard
+            self.sliceTofs, evs = self.getTofsAndEvs(tofAxis, hv)
+            tofs = self.sliceTofs
+            if config.Data_Jacobian:
+                tofs, evs = evGridAxis(hv)
+            self.axis = np.vstack((tofs, evs))
+            self.axisKey = key
+            self.axisRetard = retard
+            self.axisVersion += 1
+        return self.axis, self.axisVersion
              
     def updateLoop(self):
         '''
@@ -228,48 +334,58 @@ class ursapqDataHandler:
             self.dataUpdated.wait()
             self.dataUpdated.clear()
     
-            try:       
-                evenLowPass, oddLowPass, traceCount = self.sliceAverage(self.tofTrace[1])
-                evenAcc, oddAcc, traceCount = self.sliceAverage(self.tof_accumulator[1])
-
-                #slightly thread usafe (as accumulatorCount / gmd could be updated after sliceAverage returns)
-                #but worst case it's out by 1-2 shots out of hundreds
-                if config.Data_GmdNorm:
-                    evenAcc /= self.gmd_even_accum
-                    oddAcc  /= self.gmd_odd_accum
-
-                    evenLowPass /= self.gmd[::2].sum()
-                    oddLowPass /= self.gmd[1::2].sum()
-                else:
-                    evenAcc /= self.accumulator_count
-                    oddAcc  /= self.accumulator_count                      
-                                           
-                tofs, evs = self.getTofsAndEvs(self.tofTrace[0])
-                    
-                #Output arrays
-                self.status.data_axis = np.vstack((tofs, evs))
-                self.status.data_shots_filtered = np.array([evenLowPass, oddLowPass])
-                self.status.data_traceNum = traceCount
-                self.status.gmd_rate = self.gmd[:].sum() * 10 # 10 shots per second. gmd_rate is total GMD per second
-
-                self.status.data_shots_accumulator =  np.array([evenAcc, oddAcc])
-                self.status.data_accumulator_count = self.accumulator_count
-                self.status.data_gmd_accumulator  = self.gmd_even_accum + self.gmd_odd_accum
-                self.status.data_updateFreq = self.updateFreq
-                self.status.data_laserTrace = self.laserTrace
-                self.status.data_tofTrace   = self.tofTrace
-                
-                time_zero   = pds.read(config.Data_DOOCS_t0)['data']
-                odl_set     = pds.read(config.Data_DOOCS_odl)['data']
-                self.status.data_delay = time_zero - odl_set
-
-                if self.status.data_clear_accumulator:
-                    # Will throw TypeError in updateTofTraces and reset the accumulators
-                    self.accumulator_count = None  
-                    self.status.data_clear_accumulator = False
-                                   
+            try:
+                self.processUpdate()
             except Exception as e:
                 traceback.print_exc()   
+
+    def processUpdate(self):
+        ''' Computes the outputs from the latest data and publishes them. Body of updateLoop '''
+        evenLowPass, oddLowPass, traceCount = self.sliceAverage(self.tofTrace[1])
+
+        #slightly thread usafe (as accumulators could be updated while we read them)
+        #but worst case it's out by 1-2 shots out of hundreds
+        evenAcc, oddAcc = normalizeShots(self.even_accumulator, self.odd_accumulator, self.accumulator_count,
+                                         self.gmd_even_accum, self.gmd_odd_accum)
+        if config.Data_GmdNorm:
+            evenLowPass, oddLowPass = normalizeShots(evenLowPass, oddLowPass, 1,
+                                                     self.gmd[::2].sum(), self.gmd[1::2].sum())
+                                   
+        axis, axisVersion = self.getAxis(self.tofTrace[0], self.status.tof_retarderHV)
+        shots = np.array([evenLowPass, oddLowPass, evenAcc, oddAcc])
+        if config.Data_Jacobian:
+            #Spectra on the uniform eV grid, with the retarder voltage of the axis
+            shots = rebinToEvGrid(shots, self.sliceTofs, math.nan if self.axisRetard is None else self.axisRetard)
+            
+        time_zero   = pds.read(config.Data_DOOCS_t0)['data']
+        odl_set     = pds.read(config.Data_DOOCS_odl)['data']
+
+        #Output arrays
+        values = {
+            'data_shots_filtered'    : shots[:2],
+            'data_traceNum'          : traceCount,
+            'gmd_rate'               : self.gmd[:].sum() * 10, # 10 shots per second. gmd_rate is total GMD per second
+            'data_shots_accumulator' : shots[2:],
+            'data_accumulator_count' : self.accumulator_count,
+            'data_gmd_accumulator'   : self.gmd_even_accum + self.gmd_odd_accum,
+            'data_updateFreq'        : self.updateFreq,
+            'data_laserTrace'        : self.laserTrace,
+            'data_tofTrace'          : self.tofTrace,
+            'data_delay'             : time_zero - odl_set,
+        }
+        #The axis only when it changed, clients check data_axis_version before fetching it
+        if axisVersion != self.publishedAxisVersion:
+            values['data_axis'] = axis
+            values['data_axis_version'] = axisVersion
+        self.publish(values)
+        self.publishedAxisVersion = axisVersion
+        if self.recorder is not None:
+            self.status.data_recorder = self.recorder.stats()
+
+        if self.status.data_clear_accumulator:
+            # Will throw TypeError in updateTofTraces and reset the accumulators
+            self.accumulator_count = None  
+            self.status.data_clear_accumulator = False
                 
 def main():
     try:
@@ -278,7 +394,7 @@ def main():
         while True:
             time.sleep(5)
     except KeyboardInterrupt:
-        dataHandler.stopEvent.set()
+        dataHandler.stop() #Unlinks the shared memory segments
 
 if __name__=='__main__':
     main()
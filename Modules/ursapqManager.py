@@ -12,11 +12,131 @@ from PID import PIDFilter
 from HVPS import HVPS
 from LVPS import LVPS
 from Beckhoff import BeckhoffSys
+from scheduler import Scheduler
+from doocsExport import DoocsExporter
+from sharedNamespace import StatusNamespace, StatusProxy, StatusPublisher, WriteRequests, WriteProxy
 import pyads
 from config import config
 import time
 from icecream import ic
 
+# Simulated hardware, to run the manager without the experiment
+if getattr(config, 'Simulation', False):
+    from simulation import SimBeckhoffSys as BeckhoffSys, SimHVPS as HVPS, SimLVPS as LVPS
+
+# PLC variables read on every status update, mapped to their status names
+STATUS_READ_VARS = {
+    'MAIN.Chamber_Pressure'       : 'chamberPressure',
+    'MAIN.PreVac_Pressure'        : 'preVacPressure',
+    'MAIN.PreVac_OK'              : 'preVac_OK',
+    'MAIN.MainVac_OK'             : 'mainVac_OK',
+    'MAIN.TurboPump_ON'           : 'pumps_areON',
+    'MAIN.Turbo_NO'               : 'pumps_normalOp',
+    'MAIN.TurboMain_Freq'         : 'pump_speed',
+    'MAIN.PreVacValves_Open'      : 'preVacValve_isOpen',
+    'MAIN.LVPS_ON'                : 'LVPS_isOn',
+    'MAIN.SampleX.NcToPlc.ActPos' : 'sample_pos_x',
+    'MAIN.SampleY.NcToPlc.ActPos' : 'sample_pos_y',
+    'MAIN.SampleZ.NcToPlc.ActPos' : 'sample_pos_z',
+    'MAIN.MagnetY.NcToPlc.ActPos' : 'magnet_pos_y',
+    'MAIN.Sample_Flow'            : 'gasLine_flow',
+    'MAIN.GasLine_Pressure'       : 'gasLine_pressure',
+    'MAIN.GasLine_Enable'         : 'gasLine_enable',
+    'MAIN.Coil_Enable'            : 'coil_enable',
+    'MAIN.Coil_Curr_In'           : 'coil_current',
+    'MAIN.Sample_CapTemp'         : 'sample_capTemp',
+    'MAIN.Sample_TipTemp'         : 'sample_tipTemp',
+    'MAIN.Sample_BodyTemp'        : 'sample_bodyTemp',
+    'MAIN.Magnet_Temp'            : 'magnet_temp',
+}
+
+# Rescaling applied to PLC values before they are written to the status
+STATUS_RESCALERS = {
+    'MAIN.Sample_CapTemp' : lambda x: x / 10,
+    'MAIN.Sample_TipTemp' : lambda x: x / 10,
+    'MAIN.Sample_BodyTemp': lambda x: x / 10,
+    'MAIN.Magnet_Temp'    : lambda x: x / 10,
+}
+
+# PLC variables that clients can write, mapped to their status names
+STATUS_WRITE_VARS = {
+    'MAIN.GasLine_Enable'      : 'gasLine_enable',
+    'MAIN.Lamp1_Enable'        : 'light_enable',
+    'MAIN.PreVac_Valve_Lock'   : 'preVacValve_lock',
+    'MAIN.Pumps_Enable'        : 'pumps_enable',
+    'MAIN.SampleX_SetPoint'    : 'sample_pos_x_setPoint',
+    'MAIN.SampleY_SetPoint'    : 'sample_pos_y_setPoint',
+    'MAIN.SampleZ_SetPoint'    : 'sample_pos_z_setPoint',
+    'MAIN.SampleX_MotionEnable': 'sample_pos_x_enable',
+    'MAIN.SampleY_MotionEnable': 'sample_pos_y_enable',
+    'MAIN.SampleZ_MotionEnable': 'sample_pos_z_enable',
+    'MAIN.SampleX_MotionStop'  : 'sample_pos_x_stop',
+    'MAIN.SampleY_MotionStop'  : 'sample_pos_y_stop',
+    'MAIN.SampleZ_MotionStop'  : 'sample_pos_z_stop',
+    'MAIN.MagnetY_SetPoint'    : 'magnet_pos_y_setPoint',
+    'MAIN.MagnetY_MotionEnable': 'magnet_pos_y_enable',
+    'MAIN.MagnetY_MotionStop'  : 'magnet_pos_y_stop',
+    'MAIN.FrameX_SetPoint'     : 'frame_pos_x_setPoint',
+    'MAIN.FrameY_SetPoint'     : 'frame_pos_y_setPoint',
+    'MAIN.FrameX_MotionEnable' : 'frame_pos_x_enable',
+    'MAIN.FrameY_MotionEnable' : 'frame_pos_y_enable',
+    'MAIN.FrameX_MotionStop'   : 'frame_pos_x_stop',
+    'MAIN.FrameY_MotionStop'   : 'frame_pos_y_stop',
+    'MAIN.Sample_Flow_Set'     : 'gasLine_flow_set',
+    'MAIN.Coil_Enable'         : 'coil_enable',
+}
+
+# PLC variables written by the manager itself, mapped to their status names
+MANAGER_WRITE_VARS = {
+    'MAIN.Coil_Curr_Out'       : 'coil_current_out',
+}
+
+PLC_WRITE_VARS  = {**STATUS_WRITE_VARS, **MANAGER_WRITE_VARS}
+PLC_STATUS_VARS = {**STATUS_READ_VARS, **PLC_WRITE_VARS} # All PLC variables shown in the status
+
+def _sameValue(old, new):
+    ''' True if writing new would not change a PLC variable holding old. REALs are compared at float32 precision '''
+    if isinstance(old, float) or isinstance(new, float):
+        return math.isclose(old, new, rel_tol=1e-6, abs_tol=1e-9)
+    return old == new
+
+# HVPS channels, mapped to the status names of their measured and set voltage
+HV_CHANNELS = {
+    'Phosphor': ('mcp_phosphorHV', 'mcp_phosphorSetHV'),
+    'Back'    : ('mcp_backHV',     'mcp_backSetHV'),
+    'Front'   : ('mcp_frontHV',    'mcp_frontSetHV'),
+    'Middle'  : ('tof_middleHV',   'tof_middleSetHV'),
+    'Retarder': ('tof_retarderHV', 'tof_retarderSetHV'),
+    'Mesh'    : ('tof_meshHV',     'tof_meshSetHV'),
+}
+
+# Status values exported to DOOCS: property: (status key, deadband, relative deadband)
+# Properties are only written when the value changes by more than the deadbands
+DOOCS_EXPORT = {
+    'FLASH.UTIL/STORE/URSAPQ/PRESSURE.CHAMBER' : ('chamberPressure',   0,    0.01),
+    'FLASH.UTIL/STORE/URSAPQ/PRESSURE.PREVAC'  : ('preVacPressure',    0,    0.01),
+    'FLASH.UTIL/STORE/URSAPQ/PRESSURE.GASLINE' : ('gasLine_pressure',  0,    0.01),
+    'FLASH.UTIL/STORE/URSAPQ/MCP.PHOSPHORHV'   : ('mcp_phosphorHV',    1,    0),
+    'FLASH.UTIL/STORE/URSAPQ/MCP.BACKHV'       : ('mcp_backHV',        1,    0),
+    'FLASH.UTIL/STORE/URSAPQ/MCP.FRONTHV'      : ('mcp_frontHV',       1,    0),
+    'FLASH.UTIL/STORE/URSAPQ/TOF.MESHHV'       : ('tof_meshHV',        0.1,  0), #MESH DOES NOT EXIST
+    'FLASH.UTIL/STORE/URSAPQ/TOF.LENSHV'       : ('tof_middleHV',      0.1,  0),
+    'FLASH.UTIL/STORE/URSAPQ/TOF.RETARDERHV'   : ('tof_retarderHV',    0.1,  0),
+    'FLASH.UTIL/STORE/URSAPQ/TOF.MAGNETHV'     : (None,                0,    0),
+    'FLASH.UTIL/STORE/URSAPQ/SAMPLE.CAPTEMP'   : ('sample_capTemp',    0.1,  0),
+    'FLASH.UTIL/STORE/URSAPQ/SAMPLE.TIPTEMP'   : ('sample_tipTemp',    0.1,  0),
+    'FLASH.UTIL/STORE/URSAPQ/SAMPLE.BODYTEMP'  : ('sample_bodyTemp',   0.1,  0),
+    'FLASH.UTIL/STORE/URSAPQ/SAMPLE.GASFLOW'   : ('gasLine_flow',      0,    0.01),
+    'FLASH.UTIL/STORE/URSAPQ/MAGNET.TEMP'      : ('magnet_temp',       0.1,  0),
+    'FLASH.UTIL/STORE/URSAPQ/SAMPLE.POSX'      : ('sample_pos_x',      0.001, 0),
+    'FLASH.UTIL/STORE/URSAPQ/SAMPLE.POSY'      : ('sample_pos_y',      0.001, 0),
+    'FLASH.UTIL/STORE/URSAPQ/SAMPLE.POSZ'      : ('sample_pos_z',      0.001, 0),
+    'FLASH.UTIL/STORE/URSAPQ/MAGNET.POSY'      : ('magnet_pos_y',      0.001, 0),
+    'FLASH.UTIL/STORE/URSAPQ/COIL.CURRENT'     : ('coil_current_set',  0,    0),
+    'FLASH.UTIL/STORE/URSAPQ/COIL.AMPLITUDE'   : ('coil_wiggle_ampl',  0,    0),
+    'FLASH.UTIL/STORE/URSAPQ/COIL.FREQUENCY'   : ('coil_wiggle_freq',  0,    0),
+}
+
 class UrsapqManager:
     '''
     Keeps track of the status of all components in the setup and syncs the values
@@ -27,11 +147,13 @@ class UrsapqManager:
 
     The updateStatus(), ovenController() and HVPSController() functions can be used to get info on all tracked values.
 
-    The control is split in various threads with different tasks (one thread per task):
-        * Beckhoff readout
+    The control is split in various tasks:
+        * Beckhoff readout (main thread)
         * Oven Temperature control
         * HV power supply control
         * DOOCS update
+    All tasks but the Beckhoff readout are run at fixed rates by self.scheduler. Their timing
+    statistics are published in the status as scheduler_stats.
 
     The start() and stop() functions are used to start and stop the data update loops.
     The multiprocessing managers is always active.
@@ -46,9 +168,13 @@ class UrsapqManager:
         self.port = config.UrsapqServer_Port
         self.authkey = config.UrsapqServer_AuthKey.encode('ascii')
 
+        # Clients can subscribe to status changes on the event port, if configured
+        eventPort = getattr(config, 'UrsapqServer_EventPort', None)
+        publisher = StatusPublisher(('', eventPort), self.authkey) if eventPort else None
+
         class statusManager(BaseManager): pass
-        statusObj = Namespace()
-        statusManager.register('getStatusNamespace', callable = lambda:statusObj, proxytype=NamespaceProxy)
+        statusObj = StatusNamespace(publisher)
+        statusManager.register('getStatusNamespace', callable = lambda:statusObj, proxytype=StatusProxy)
         self.manager = statusManager(('', self.port), self.authkey)
 
         self.manager.start()
@@ -59,19 +185,32 @@ class UrsapqManager:
         self.writeKey = config.UrsapqServer_WriteKey.encode('ascii')
 
         class writeManager(BaseManager): pass
-        writeRequestObj = Namespace()
-        writeManager.register('getWriteNamespace', callable = lambda:writeRequestObj, proxytype=NamespaceProxy)
+        writeRequestObj = WriteRequests()
+        writeManager.register('getWriteNamespace', callable = lambda:writeRequestObj, proxytype=WriteProxy)
         self.writeManager = writeManager(('', self.writePort), self.writeKey)
 
         self.writeManager.start()
         self.writeStatus = self.writeManager.getWriteNamespace()
 
+        # Write requests drained from writeStatus, waiting to be processed (see _getParamWrite)
+        self.writeRequests = {}
+        self.writeLock = threading.Lock()
+
         # Instances of hardware control modules
         self.beckhoff = BeckhoffSys()
         self.LVPS = LVPS()
         self.HVPS = HVPS()
 
-        self.controls_stop = threading.Event()  # Stops event for control threads of oven and HVPS controllers
+        # Periodic control tasks
+        self.scheduler = Scheduler(getattr(config, 'UrsapqServer_Workers', 4))
+        self.scheduler.add('LVPS', self.LVPSController, config.LVPS.ControlPeriod)
+        self.scheduler.add('HVPS', self.HVPSController, config.HVPS.UpdatePeriod)
+
+        # If set, PLC_STATUS_VARS are pushed by the PLC through ADS notifications instead of polled
+        self.plcNotifications = getattr(config, 'Beckhoff_Notifications', False)
+
+        # Last known (raw) value of the PLC variables, used to skip writes that change nothing
+        self.plcValues = {}
 
         #PID filters
         self.OvenPID =  PIDFilter(**config.OvenPID.init_params._asdict())
@@ -84,8 +223,15 @@ class UrsapqManager:
         #If config is set, initialize DOOCS communication
         self.doocs = config.UrsapqServer_WriteDoocs # if true we write data to doo
         if self.doocs:
-            self.pydoocs = __import__('pydoocs')
-            self.doocs_stop = threading.Event() # Stops event for DOOCS update thread
+            if getattr(config, 'Simulation', False):
+                from simulation import SimDoocs
+                self.pydoocs = SimDoocs()
+            else:
+                self.pydoocs = __import__('pydoocs')
+            self.doocsExporter = DoocsExporter(self.pydoocs, DOOCS_EXPORT,
+                                               getattr(config, 'UrsapqServer_DoocsWorkers', 2),
+                                               getattr(config, 'UrsapqServer_DoocsRefreshPeriod', 60))
+            self.scheduler.add('DOOCS', self.writeDoocs, config.UrsapqServer_DoocsUpdatePeriod)
 
         self.setMessage("Server is ready, but not started")
 
@@ -108,6 +254,8 @@ class UrsapqManager:
         ''' Starts status update operations. '''
         self.setMessage("Attempting to start server...")
         self.beckhoff.start()
+        self.plcValues = {}
+        self.lastUpdateStart = None
 
         self.status.coil_current = math.nan
         self.status.coil_setCurrent = math.nan
@@ -117,32 +265,45 @@ class UrsapqManager:
         self.status.coil_current_set = 0
         self.status.oven_enable = False
 
-        self.updateStatus()
-
-        self.controls_stop.clear()
-        self.LVPSController()
-        self.HVPSController()
+        if self.plcNotifications:
+            self.beckhoff.subscribe(PLC_STATUS_VARS.keys(), self._onPlcChange)
+            # Seeds the values with one sum read, as the first notifications come asynchronously
+            self.status.update(self._beckhoff_read_bulk(PLC_STATUS_VARS, STATUS_RESCALERS))
 
-        if self.doocs:
-            self.doocs_stop.clear()
-            self.writeDoocs()
+        self.updateStatus()
+        self.scheduler.start()
 
         self.setMessage("Server running")
 
     def stop(self):
-        ''' Stops status update operations. '''
+        ''' Stops status update operations and switches off the power supplies. '''
         self.beckhoff.stop()
-        self.controls_stop.set()
-
+        self.scheduler.stop() # Waits for running tasks, so that the serial ports are free
         if self.doocs:
-            self.doocs_stop.set()
+            self.doocsExporter.close() # Waits for the queued DOOCS writes
+
+        try:
+            self.LVPS.allOff()
+        except serial.serialutil.SerialException:
+            pass
+        self.LVPS.close()
+        self.OvenPID.reset()
+
+        try:
+            self.HVPS.tofEnable = False
+            self.HVPS.mcpEnable = False
+            self.status.tof_hvEnable = False
+            self.status.mcp_hvEnable = False
+        except Exception:
+            pass
+        self.HVPS.close()
 
         self.setMessage("Server stopped")
 
     #Wrapper functions read/write parameter from PLC
     def _beckhoff_read_bulk(self, names_dict, rescaler_dict= None):
-        ''' Read the variables from beckhoff and update their 
-            vaules in the status dict. Beckhoff variable names should be 
+        ''' Read the variables from beckhoff and return a dict with their
+            vaules, to be written in the status dict. Beckhoff variable names should be 
             the keys of <names_dict>, vaules should map to the corresponding 
             variable names in the satus dict 
             
@@ -151,168 +312,132 @@ class UrsapqManager:
         rescaler_dict = rescaler_dict or {}
 
         response = self.beckhoff.read_multiple(names_dict.keys())
-        for name, value in response.items():
-            if name in rescaler_dict:
-                value = rescaler_dict[name](value)
-            self.status.__setattr__(names_dict[name], value)
+        self.plcValues.update(response)
+        for name, rescaler in rescaler_dict.items():
+            response[name] = rescaler(response[name])
+        return {names_dict[name]: value for name, value in response.items()}
     
+    def _onPlcChange(self, name, value):
+        ''' Called by ADS notifications when a variable in PLC_STATUS_VARS changes on the PLC '''
+        self.plcValues[name] = value
+        if name in STATUS_RESCALERS:
+            value = STATUS_RESCALERS[name](value)
+        self.status.__setattr__(PLC_STATUS_VARS[name], value)
+
     def _beckhoff_write_bulk(self, names_dict):
         ''' Check if a write request is present in the write_status dict,
             and update the coreesponding parameter on the plc.
             Keys of names_dict should correspond to PLC names, values to 
-            status dict names'''
-
-        request = {}
-        for plc_name, status_name in names_dict.items():
-            try:
-                newval = self.writeStatus.__getattr__(status_name)
-                self.writeStatus.__delattr__(status_name)
-                request.update({plc_name: newval})
-            except:
-                pass
-
-        self.beckhoff.write_multiple(request)
-        self._beckhoff_read_bulk(names_dict) #update va
+            status dict names. Returns the updated values read back from the plc
+
+            Requests that match the last known value of the variable (see plcValues) are skipped,
+            and only the variables actually written are read back. The number of written and
+            skipped variables is returned as beckhoff_writeCount and beckhoff_writeSkipped.
+            Writes rejected by the PLC are reported with setMessage and are not counted as written'''
+
+        with self.writeLock:
+            request = {plc_name: self.writeRequests.pop(status_name)
+                       for plc_name, status_name in names_dict.items()
+                       if status_name in self.writeRequests}
+
+        changed = {name: value for name, value in request.items()
+                   if name not in self.plcValues or not _sameValue(self.plcValues[name], value)}
+
+        response, rejected = {}, {}
+        if changed:
+            rejected = self.beckhoff.write_multiple(changed)
+            if rejected:
+                print(f"PLC rejected writes: {rejected}")
+                self.setMessage("WARNING: PLC rejected write of " + ", ".join(names_dict[name] for name in rejected), 10)
+            response = self._beckhoff_read_bulk({name: names_dict[name] for name in changed}) #update values, also of rejected writes
+
+        response['beckhoff_writeCount'] = len(changed) - len(rejected)
+        response['beckhoff_writeSkipped'] = len(request) - len(changed)
+        return response
+
+    #Wrapper functions to make processing of write requests from clients cleaner
+    def _drainWriteRequests(self):
+        ''' Collects all pending client write requests with a single call to the write namespace '''
+        requests = self.writeStatus.drain()
+        with self.writeLock:
+            self.writeRequests.update(requests)
 
-    #Wrapper function to make processing of write requests from clients cleaner
     def _getParamWrite(self, key):
         ''' Checks if a paramater write request has been made by a client. If so, returns the value and deletes
-            the request. Returns none otherwise '''
-        try:
-            var = self.writeStatus.__getattr__(key)
-            self.writeStatus.__delattr__(key)
-            return var
-        except:
-            return None
+            the request. Returns none otherwise. Requests are collected by _drainWriteRequests '''
+        with self.writeLock:
+            return self.writeRequests.pop(key, None)
+
+    def _setParamWrite(self, key, val):
+        ''' Adds a write request from the manager itself '''
+        with self.writeLock:
+            self.writeRequests[key] = val
 
     def writeDoocs(self):
-        ''' Writes values to DOOCS '''
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/PRESSURE.CHAMBER", self.status.chamberPressure)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/PRESSURE.PREVAC",  self.status.preVacPressure)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/PRESSURE.GASLINE", self.status.gasLine_pressure)
-
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/MCP.PHOSPHORHV", self.status.mcp_phosphorHV)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/MCP.BACKHV",     self.status.mcp_backHV)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/MCP.FRONTHV",    self.status.mcp_frontHV)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/TOF.MESHHV",     self.status.tof_meshHV) #MESH DOES NOT EXIST
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/TOF.LENSHV",     self.status.tof_middleHV)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/TOF.RETARDERHV", self.status.tof_retarderHV)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/TOF.MAGNETHV",   math.nan)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/SAMPLE.CAPTEMP",      self.status.sample_capTemp)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/SAMPLE.TIPTEMP",      self.status.sample_tipTemp)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/SAMPLE.BODYTEMP",     self.status.sample_bodyTemp)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/SAMPLE.GASFLOW",      self.status.gasLine_flow)
-
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/MAGNET.TEMP", self.status.magnet_temp)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/SAMPLE.POSX", self.status.sample_pos_x)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/SAMPLE.POSY", self.status.sample_pos_y)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/SAMPLE.POSZ", self.status.sample_pos_z)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/MAGNET.POSY", self.status.magnet_pos_y)
-        
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/COIL.CURRENT", self.status.coil_current_set)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/COIL.AMPLITUDE", self.status.coil_wiggle_ampl)
-        self.pydoocs.write("FLASH.UTIL/STORE/URSAPQ/COIL.FREQUENCY", self.status.coil_wiggle_freq)
-
-        if not self.doocs_stop.is_set():
-            threading.Timer(config.UrsapqServer_DoocsUpdatePeriod, self.writeDoocs).start()
+        ''' Writes the values that changed to DOOCS. Writes are done in the background by self.doocsExporter '''
+        self.doocsExporter.export(self.status.snapshot(self.doocsExporter.keys()))
 
     def updateStatus(self, verbose = False):
         '''
         Main update function. Reads/Writes values from beckhoff to the status namespace and
         updates the oven temperature set points if needed.
+        All new values are collected in a dict and written to the status namespace at
+        the end in one go, so that clients see a coherent status
         '''
-        #Update 'read only' values from PLC
-        self._beckhoff_read_bulk({
-            'MAIN.Chamber_Pressure'       : 'chamberPressure',
-            'MAIN.PreVac_Pressure'        : 'preVacPressure',
-            'MAIN.PreVac_OK'              : 'preVac_OK',
-            'MAIN.MainVac_OK'             : 'mainVac_OK',
-            'MAIN.TurboPump_ON'           : 'pumps_areON',
-            'MAIN.Turbo_NO'               : 'pumps_normalOp',
-            'MAIN.TurboMain_Freq'         : 'pump_speed',
-            'MAIN.PreVacValves_Open'      : 'preVacValve_isOpen',
-            'MAIN.LVPS_ON'                : 'LVPS_isOn',
-            'MAIN.SampleX.NcToPlc.ActPos' : 'sample_pos_x',
-            'MAIN.SampleY.NcToPlc.ActPos' : 'sample_pos_y',
-            'MAIN.SampleZ.NcToPlc.ActPos' : 'sample_pos_z',
-            'MAIN.MagnetY.NcToPlc.ActPos' : 'magnet_pos_y',
-            'MAIN.Sample_Flow'            : 'gasLine_flow',
-            'MAIN.GasLine_Pressure'       : 'gasLine_pressure',
-            'MAIN.GasLine_Enable'         : 'gasLine_enable',
-            'MAIN.Coil_Enable'            : 'coil_enable',
-            'MAIN.Coil_Curr_In'           : 'coil_current',
-            'MAIN.Sample_CapTemp'         : 'sample_capTemp',
-            'MAIN.Sample_TipTemp'         : 'sample_tipTemp',
-            'MAIN.Sample_BodyTemp'        : 'sample_bodyTemp',
-            'MAIN.Magnet_Temp'            : 'magnet_temp',
-        }, rescaler_dict={
-            'MAIN.Sample_CapTemp' : lambda x: x / 10,
-            'MAIN.Sample_TipTemp' : lambda x: x / 10,
-            'MAIN.Sample_BodyTemp': lambda x: x / 10,
-            'MAIN.Magnet_Temp'    : lambda x: x / 10,            
-        })
+        start = time.monotonic()
+        self._drainWriteRequests()
+        status = self.status.snapshot(['coil_wiggle_ampl', 'coil_wiggle_freq', 'coil_current_set', 'oven_enable'])
+
+        #Update 'read only' values from PLC, unless they are pushed by notifications
+        if self.plcNotifications:
+            plc = self.status.snapshot(['gasLine_enable', 'chamberPressure'])
+        else:
+            plc = self._beckhoff_read_bulk(PLC_STATUS_VARS, STATUS_RESCALERS)
+            status.update(plc)
 
         # Coil wiggle
         newWiggleAmpl = self._getParamWrite('coil_wiggle_ampl')
-        if newWiggleAmpl is not None: self.status.coil_wiggle_ampl = newWiggleAmpl
+        if newWiggleAmpl is not None: status['coil_wiggle_ampl'] = newWiggleAmpl
 
         newWiggleFreq = self._getParamWrite('coil_wiggle_freq')
-        if newWiggleFreq is not None: self.status.coil_wiggle_freq = newWiggleFreq
+        if newWiggleFreq is not None: status['coil_wiggle_freq'] = newWiggleFreq
 
         newCurrent = self._getParamWrite('coil_current_set')
-        if newCurrent is not None: self.status.coil_current_set = newCurrent
+        if newCurrent is not None: status['coil_current_set'] = newCurrent
 
-        wiggle = self.status.coil_wiggle_ampl/2*math.sin(self.status.coil_wiggle_freq*2*math.pi*time.time()) #Wiggle component
-        self.beckhoff.write("MAIN.Coil_Curr_Out", int(self.status.coil_current_set + wiggle), pyads.PLCTYPE_INT)
+        wiggle = status['coil_wiggle_ampl']/2*math.sin(status['coil_wiggle_freq']*2*math.pi*time.time()) #Wiggle component
+        self._setParamWrite('coil_current_out', int(status['coil_current_set'] + wiggle))
 
         # Oven/Pressure PIDs
         oven_enable = self._getParamWrite('oven_enable')
-        if oven_enable is not None: self.status.oven_enable = oven_enable
+        if oven_enable is not None: status['oven_enable'] = oven_enable
 
         newOvenTemp = self._getParamWrite('oven_setPoint')
         if newOvenTemp is not None: self.OvenPID.setPoint = newOvenTemp
-        self.status.oven_setPoint = self.OvenPID.setPoint
+        status['oven_setPoint'] = self.OvenPID.setPoint
 
         newPressureSetP = self._getParamWrite('pressurePID_setPoint')
         if newPressureSetP is not None: self.PressurePID.setPoint = min(newPressureSetP, config.PressurePID.max_setp)
-        self.status.pressurePID_setPoint = self.PressurePID.setPoint
+        status['pressurePID_setPoint'] = self.PressurePID.setPoint
 
-        if self.status.gasLine_enable:
-            self.writeStatus.gasLine_flow_set = self.PressurePID.filter(self.status.chamberPressure)
+        if plc['gasLine_enable']:
+            self._setParamWrite('gasLine_flow_set', self.PressurePID.filter(plc['chamberPressure']))
         else:
-            self.writeStatus.gasLine_flow_set = 0
+            self._setParamWrite('gasLine_flow_set', 0)
             self.PressurePID.reset()
 
         # Forward writes to PLC
-        self._beckhoff_write_bulk({
-            'MAIN.GasLine_Enable'      : 'gasLine_enable',
-            'MAIN.Lamp1_Enable'        : 'light_enable',
-            'MAIN.PreVac_Valve_Lock'   : 'preVacValve_lock',
-            'MAIN.Pumps_Enable'        : 'pumps_enable',
-            'MAIN.SampleX_SetPoint'    : 'sample_pos_x_setPoint',
-            'MAIN.SampleY_SetPoint'    : 'sample_pos_y_setPoint',
-            'MAIN.SampleZ_SetPoint'    : 'sample_pos_z_setPoint',
-            'MAIN.SampleX_MotionEnable': 'sample_pos_x_enable',
-            'MAIN.SampleY_MotionEnable': 'sample_pos_y_enable',
-            'MAIN.SampleZ_MotionEnable': 'sample_pos_z_enable',
-            'MAIN.SampleX_MotionStop'  : 'sample_pos_x_stop',
-            'MAIN.SampleY_MotionStop'  : 'sample_pos_y_stop',
-            'MAIN.SampleZ_MotionStop'  : 'sample_pos_z_stop',
-            'MAIN.MagnetY_SetPoint'    : 'magnet_pos_y_setPoint',
-            'MAIN.MagnetY_MotionEnable': 'magnet_pos_y_enable',
-            'MAIN.MagnetY_MotionStop'  : 'magnet_pos_y_stop',
-            'MAIN.FrameX_SetPoint'     : 'frame_pos_x_setPoint',
-            'MAIN.FrameY_SetPoint'     : 'frame_pos_y_setPoint',
-            'MAIN.FrameX_MotionEnable' : 'frame_pos_x_enable',
-            'MAIN.FrameY_MotionEnable' : 'frame_pos_y_enable',
-            'MAIN.FrameX_MotionStop'   : 'frame_pos_x_stop',
-            'MAIN.FrameY_MotionStop'   : 'frame_pos_y_stop',
-            'MAIN.Sample_Flow_Set'     : 'gasLine_flow_set',
-            'MAIN.Coil_Enable'         : 'coil_enable',
-        })
+        status.update(self._beckhoff_write_bulk(PLC_WRITE_VARS))
 
         #If update complete sucessfully, update timestamp
-        self.status.lastUpdate = datetime.now()
+        status['lastUpdate'] = datetime.now()
+        status['manager_updateDuration'] = time.monotonic() - start # Time taken by this update
+        status['manager_updatePeriod'] = start - self.lastUpdateStart if self.lastUpdateStart else math.nan
+        self.lastUpdateStart = start
+        status['scheduler_stats'] = self.scheduler.stats()
+        if self.doocs:
+            status['doocs_stats'] = self.doocsExporter.stats()
+        self.status.update(status)
 
     #Manages sample oven tempearture control loop
     def LVPSController(self):
@@ -327,23 +452,25 @@ class UrsapqManager:
             try:
                 self.LVPS.connect()
 
-                if self.status.oven_enable:
-                    self.LVPS.Oven.on()
-                    # Applied power scales with square of voltage. Since the filters outputs a voltage we sqrt
-                    # the PID out to make it linear in applied power.
-                    self.LVPS.Oven.setVoltage  = math.sqrt(self.OvenPID.filter(self.status.sample_bodyTemp))
-
-                    # Write oven status variable
-                    if self.OvenPID.lastErr is not None and abs(self.OvenPID.lastErr) < config.OvenPID.NormalOpMaxErr:
-                        self.status.oven_PIDStatus = "OK"
+                # Commands are sent in one line with the power query
+                with self.LVPS.batch():
+                    if self.status.oven_enable:
+                        self.LVPS.Oven.on()
+                        # Applied power scales with square of voltage. Since the filters outputs a voltage we sqrt
+                        # the PID out to make it linear in applied power.
+                        self.LVPS.Oven.setVoltage  = math.sqrt(self.OvenPID.filter(self.status.sample_bodyTemp))
+
+                        # Write oven status variable
+                        if self.OvenPID.lastErr is not None and abs(self.OvenPID.lastErr) < config.OvenPID.NormalOpMaxErr:
+                            self.status.oven_PIDStatus = "OK"
+                        else:
+                            self.status.oven_PIDStatus = "TRACKING"
                     else:
-                        self.status.oven_PIDStatus = "TRACKING"
-                else:
-                    self.LVPS.Oven.off()
-                    self.OvenPID.reset()
-                    self.status.oven_PIDStatus = "OFF"
+                        self.LVPS.Oven.off()
+                        self.OvenPID.reset()
+                        self.status.oven_PIDStatus = "OFF"
 
-                self.status.oven_output_pow  = self.LVPS.Oven.power
+                    self.status.oven_output_pow  = self.LVPS.Oven.power
 
             # If connection failed, set everything to NaN and reset PID filters
             except Exception as e:
@@ -366,19 +493,6 @@ class UrsapqManager:
                 self.setMessage("WARNING: LVPS disabled, cannot run oven (overtemp/overpressure?)", 5)
             else:
                 self.status.oven_PIDStatus = "OFF"
-                
-
-        # If stopping, switch everything off and reset PID filters
-        if self.controls_stop.is_set():
-            try:
-                self.LVPS.allOff()
-            except serial.serialutil.SerialException:
-                pass
-            self.LVPS.close()
-            self.OvenPID.reset()
-        # If not stopping, calls itself again after configurable interval
-        else:
-            threading.Timer(config.LVPS.ControlPeriod, self.LVPSController).start()
 
     def HVPSController(self):
         '''
@@ -394,6 +508,7 @@ class UrsapqManager:
         try:
             # Try connecting
             self.HVPS.connect()
+            self._drainWriteRequests()
 
             # Check if user has changed the enable status and acts on it
             tofEn = self._getParamWrite('tof_hvEnable')
@@ -404,48 +519,30 @@ class UrsapqManager:
             self.status.tof_hvEnable = self.HVPS.tofEnable
             self.status.mcp_hvEnable = self.HVPS.mcpEnable
 
-            # Update actual voltages
-            self.status.mcp_phosphorHV  = self.HVPS.Phosphor.voltage
-            self.status.mcp_backHV      = self.HVPS.Back.voltage
-            self.status.mcp_frontHV     = self.HVPS.Front.voltage
-            self.status.tof_middleHV    = self.HVPS.Middle.voltage
-            self.status.tof_retarderHV  = self.HVPS.Retarder.voltage
-            self.status.tof_meshHV      = self.HVPS.Mesh.voltage
-            
-            
-            # Read in write requests for voltage setpoints
-            newMiddle     = self._getParamWrite('tof_middleSetHV')
-            newRetarter   = self._getParamWrite('tof_retarderSetHV')
-            newMesh       = self._getParamWrite('tof_meshSetHV')
-            newPhosphor = self._getParamWrite('mcp_phosphorSetHV')
-            newBack     = self._getParamWrite('mcp_backSetHV')
-            newFront    = self._getParamWrite('mcp_frontSetHV')
+            # Update actual voltages, all channels at once
+            status = {}
+            voltages = self.HVPS.voltages()
+            for name, (statusName, _) in HV_CHANNELS.items():
+                status[statusName] = voltages[name]
 
             # Apply new setpoints if needed
-            if newMiddle     is not None: self.HVPS.Middle.setVoltage = newMiddle
-            if newRetarter   is not None: self.HVPS.Retarder.setVoltage = newRetarter
-            if newMesh       is not None: self.HVPS.Mesh.setVoltage = newMesh
-            
-            if newPhosphor is not None: self.HVPS.Phosphor.setVoltage = newPhosphor
-            if newBack     is not None: self.HVPS.Back.setVoltage = newBack
-            if newFront    is not None: self.HVPS.Front.setVoltage = newFront
+            for name, (_, setStatusName) in HV_CHANNELS.items():
+                newVoltage = self._getParamWrite(setStatusName)
+                if newVoltage is not None: self.HVPS.channels[name].setVoltage = newVoltage
 
             #prevent MCP overvoltage by limiting back-front deltaV
             #Must be done after others setpoints have been loaded
-            if self.HVPS.Back.setVoltage < self.HVPS.Front.setVoltage:
-                self.HVPS.Back.setVoltage = self.HVPS.Front.setVoltage
-                self.setMessage("WARNING: MCP Back voltage setpoint rescaled", 30)
-            if self.HVPS.Back.setVoltage > self.HVPS.Front.setVoltage + config.HVPS.MaxFrontBackDeltaV:
-                self.HVPS.Back.setVoltage = self.HVPS.Front.setVoltage + config.HVPS.MaxFrontBackDeltaV
+            setVoltages = self.HVPS.setVoltages()
+            back, front = setVoltages['Back'], setVoltages['Front']
+            if back < front or back > front + config.HVPS.MaxFrontBackDeltaV:
+                self.HVPS.Back.setVoltage = min(max(back, front), front + config.HVPS.MaxFrontBackDeltaV)
                 self.setMessage("WARNING: MCP Back voltage setpoint rescaled", 30)
+                setVoltages = self.HVPS.setVoltages()
 
             # Update setPoint status
-            self.status.tof_middleSetHV    = self.HVPS.Middle.setVoltage
-            self.status.tof_retarderSetHV  = self.HVPS.Retarder.setVoltage
-            self.status.tof_meshSetHV      = self.HVPS.Mesh.setVoltage
-            self.status.mcp_phosphorSetHV   = self.HVPS.Phosphor.setVoltage
-            self.status.mcp_backSetHV       = self.HVPS.Back.setVoltage
-            self.status.mcp_frontSetHV      = self.HVPS.Front.setVoltage
+            for name, (_, setStatusName) in HV_CHANNELS.items():
+                status[setStatusName] = setVoltages[name]
+            self.status.update(status)
 
             if self.HVPS.tofEnable and self.HVPS.mcpEnable:
                 self.status.HV_Status = "OK"
@@ -476,18 +573,6 @@ class UrsapqManager:
             print(traceback.format_exc())
             self.HVPS.close()
 
-        if self.controls_stop.is_set():
-            try:
-                self.HVPS.tofEnable = False
-                self.HVPS.mcpEnable = False
-                self.status.tof_hvEnable = False
-                self.status.mcp_hvEnable = False
-            except Exception:
-                pass
-            self.HVPS.close()
-        else:
-            threading.Timer(config.HVPS.UpdatePeriod, self.HVPSController).start()
-
 def main():
     expManager = UrsapqManager()
 
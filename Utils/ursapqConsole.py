@@ -59,6 +59,8 @@ class ConsoleWindow(QObject):
         self.window.close()
 
 class VacuumWindow(ConsoleWindow):
+    STATUS_KEYS = ['preVacValve_lock', 'pumps_enable'] # Shown by update(), fetched with a single snapshot
+
     def __init__(self, ursapq, *args, **kvargs):
         super(VacuumWindow, self).__init__('vacuum.ui', *args, **kvargs)
         self.ursapq = ursapq
@@ -73,8 +75,9 @@ class VacuumWindow(ConsoleWindow):
         self.pumpsEnable.clicked.connect(self.enablePumps)
 
     def update(self):
-        self.prevacValveLock.setChecked( self.ursapq.preVacValve_lock )
-        self.pumpsEnable.setChecked( self.ursapq.pumps_enable )
+        status = self.ursapq.snapshot(self.STATUS_KEYS)
+        self.prevacValveLock.setChecked( status.preVacValve_lock )
+        self.pumpsEnable.setChecked( status.pumps_enable )
 
     #Callbacks:
     @Slot()
@@ -86,6 +89,9 @@ class VacuumWindow(ConsoleWindow):
         self.ursapq.pumps_enable = self.pumpsEnable.isChecked()
 
 class ManipulatorWindow(ConsoleWindow):
+    STATUS_KEYS = ['magnet_pos_y', 'sample_pos_x', 'sample_pos_y', 'sample_pos_z',
+                   'sample_pos_x_stop', 'sample_pos_y_stop', 'sample_pos_z_stop', 'magnet_pos_y_stop']
+
     def __init__(self, ursapq, *args, **kvargs):
         super(ManipulatorWindow, self).__init__('manipulator.ui', *args, **kvargs)
         self.ursapq = ursapq
@@ -103,15 +109,16 @@ class ManipulatorWindow(ConsoleWindow):
         self.window.stopButton.clicked.connect(self.stop_motion)
 
     def update(self):
-        self.window.mag_y.setText( 'Y = {:.1f}'.format(self.ursapq.magnet_pos_y))
-        self.window.pos_x.setText( 'X = {:.1f}'.format(self.ursapq.sample_pos_x))
-        self.window.pos_y.setText( 'Y = {:.1f}'.format(self.ursapq.sample_pos_y))
-        self.window.pos_z.setText( 'Z = {:.1f}'.format(self.ursapq.sample_pos_z))
+        status = self.ursapq.snapshot(self.STATUS_KEYS)
+        self.window.mag_y.setText( 'Y = {:.1f}'.format(status.magnet_pos_y))
+        self.window.pos_x.setText( 'X = {:.1f}'.format(status.sample_pos_x))
+        self.window.pos_y.setText( 'Y = {:.1f}'.format(status.sample_pos_y))
+        self.window.pos_z.setText( 'Z = {:.1f}'.format(status.sample_pos_z))
         
-        motionlocked = self.ursapq.sample_pos_x_stop or \
-                       self.ursapq.sample_pos_y_stop or \
-                       self.ursapq.sample_pos_z_stop or \
-                       self.ursapq.magnet_pos_y_stop
+        motionlocked = status.sample_pos_x_stop or \
+                       status.sample_pos_y_stop or \
+                       status.sample_pos_z_stop or \
+                       status.magnet_pos_y_stop
             
         self.window.stopButton.setChecked(motionlocked)
         self.window.stopButton.setText("Unlock" if motionlocked else "Stop")
@@ -160,6 +167,9 @@ class ManipulatorWindow(ConsoleWindow):
         self.ursapq.magnet_pos_y_stop = self.window.stopButton.isChecked()
         
 class SampleWindow(ConsoleWindow):
+    STATUS_KEYS = ['oven_enable', 'gasLine_enable', 'sample_bodyTemp', 'oven_output_pow', 'oven_setPoint',
+                   'chamberPressure', 'pressurePID_setPoint', 'gasLine_flow', 'gasLine_flow_set']
+
     def __init__(self, ursapq, *args, **kvargs):
         super(SampleWindow, self).__init__('sample.ui', *args, **kvargs)
         self.ovenSwitch = Switch(thumb_radius=11, track_radius=8)
@@ -177,15 +187,16 @@ class SampleWindow(ConsoleWindow):
         self.gasLine_switch.clicked.connect(self.gasLine_enable)
 
     def update(self):
-        self.ovenSwitch.setChecked( self.ursapq.oven_enable )
-        self.gasLine_switch.setChecked( self.ursapq.gasLine_enable )
-        self.window.oven_temp.setText(  '{:.2f}'.format(self.ursapq.sample_bodyTemp))
-        self.window.ovenPow.setText(  '{:.2f}'.format(self.ursapq.oven_output_pow))
-        self.window.ovenSetPoint.setText('{:.1f}'.format(self.ursapq.oven_setPoint))
-        self.window.press_act.setText('{:.1e}'.format(self.ursapq.chamberPressure))
-        self.window.press_set.setText('{:.1e}'.format(self.ursapq.pressurePID_setPoint))
-        self.window.flow_act.setText('{:.0%}'.format(self.ursapq.gasLine_flow))
-        self.window.flow_set.setText('{:.0%}'.format(self.ursapq.gasLine_flow_set))
+        status = self.ursapq.snapshot(self.STATUS_KEYS)
+        self.ovenSwitch.setChecked( status.oven_enable )
+        self.gasLine_switch.setChecked( status.gasLine_enable )
+        self.window.oven_temp.setText(  '{:.2f}'.format(status.sample_bodyTemp))
+        self.window.ovenPow.setText(  '{:.2f}'.format(status.oven_output_pow))
+        self.window.ovenSetPoint.setText('{:.1f}'.format(status.oven_setPoint))
+        self.window.press_act.setText('{:.1e}'.format(status.chamberPressure))
+        self.window.press_set.setText('{:.1e}'.format(status.pressurePID_setPoint))
+        self.window.flow_act.setText('{:.0%}'.format(status.gasLine_flow))
+        self.window.flow_set.setText('{:.0%}'.format(status.gasLine_flow_set))
 
         self.updateTimer.setInterval( self.updateTime )
 
@@ -220,6 +231,11 @@ class SampleWindow(ConsoleWindow):
             pass
 
 class SpectrometerWindow(ConsoleWindow):
+    STATUS_KEYS = ['mcp_hvEnable', 'tof_hvEnable', 'coil_enable',
+                   'mcp_frontHV', 'mcp_backHV', 'mcp_phosphorHV', 'mcp_frontSetHV', 'mcp_backSetHV', 'mcp_phosphorSetHV',
+                   'tof_retarderHV', 'tof_retarderSetHV', 'coil_current', 'coil_current_set',
+                   'coil_wiggle_freq', 'coil_wiggle_ampl']
+
     def __init__(self, ursapq, *args, **kvargs):
         super(SpectrometerWindow, self).__init__('spectrometer.ui', *args, **kvargs)
         self.mcpEnableSwitch = Switch(thumb_radius=11, track_radius=8)
@@ -240,24 +256,25 @@ class SpectrometerWindow(ConsoleWindow):
         self.window.tofSetButton.clicked.connect(self.tofSet)
 
     def update(self):
-        self.mcpEnableSwitch.setChecked( self.ursapq.mcp_hvEnable )
-        self.tofEnableSwitch.setChecked( self.ursapq.tof_hvEnable )
-        self.coilEnableSwitch.setChecked( self.ursapq.coil_enable )
-
-        self.window.mcpFront_act.setText(  '{:.1f}'.format(self.ursapq.mcp_frontHV))
-        self.window.mcpBack_act.setText(   '{:.1f}'.format(self.ursapq.mcp_backHV))
-        self.window.mcpPhos_act.setText(   '{:.1f}'.format(self.ursapq.mcp_phosphorHV))
-        self.window.mcpFront_set.setText(  '{:.1f}'.format(self.ursapq.mcp_frontSetHV))
-        self.window.mcpBack_set.setText(   '{:.1f}'.format(self.ursapq.mcp_backSetHV))
-        self.window.mcpPhos_set.setText(   '{:.1f}'.format(self.ursapq.mcp_phosphorSetHV))
-
-        self.window.tofRetarder_act.setText( '{:.1f}'.format(self.ursapq.tof_retarderHV))
-        self.window.tofRetarder_set.setText( '{:.1f}'.format(self.ursapq.tof_retarderSetHV))
-        self.window.coilCurr_act.setText( '{:.0f}'.format(self.ursapq.coil_current))
-        self.window.coilCurr_set.setText( '{:.0f}'.format(self.ursapq.coil_current_set))        
-
-        self.window.wiggle_f.setText( '{:.2f}'.format(self.ursapq.coil_wiggle_freq))
-        self.window.wiggle_a.setText( '{:.0f}'.format(self.ursapq.coil_wiggle_ampl))      
+        status = self.ursapq.snapshot(self.STATUS_KEYS)
+        self.mcpEnableSwitch.setChecked( status.mcp_hvEnable )
+        self.tofEnableSwitch.setChecked( status.tof_hvEnable )
+        self.coilEnableSwitch.setChecked( status.coil_enable )
+
+        self.window.mcpFront_act.setText(  '{:.1f}'.format(status.mcp_frontHV))
+        self.window.mcpBack_act.setText(   '{:.1f}'.format(status.mcp_backHV))
+        self.window.mcpPhos_act.setText(   '{:.1f}'.format(status.mcp_phosphorHV))
+        self.window.mcpFront_set.setText(  '{:.1f}'.format(status.mcp_frontSetHV))
+        self.window.mcpBack_set.setText(   '{:.1f}'.format(status.mcp_backSetHV))
+        self.window.mcpPhos_set.setText(   '{:.1f}'.format(status.mcp_phosphorSetHV))
+
+        self.window.tofRetarder_act.setText( '{:.1f}'.format(status.tof_retarderHV))
+        self.window.tofRetarder_set.setText( '{:.1f}'.format(status.tof_retarderSetHV))
+        self.window.coilCurr_act.setText( '{:.0f}'.format(status.coil_current))
+        self.window.coilCurr_set.setText( '{:.0f}'.format(status.coil_current_set))        
+
+        self.window.wiggle_f.setText( '{:.2f}'.format(status.coil_wiggle_freq))
+        self.window.wiggle_a.setText( '{:.0f}'.format(status.coil_wiggle_ampl))      
 
         self.updateTimer.setInterval( self.updateTime )
 
@@ -368,73 +385,73 @@ class MainWindow(ConsoleWindow):
         self.window.gasLine_pressure.installEventFilter(self)
         pass
 
-    def updateManipulator(self):
-        self.lightSwitch.setChecked( self.ursapq.light_enable )
+    def updateManipulator(self, status):
+        self.lightSwitch.setChecked( status.light_enable )
 
-    def updateVacuum(self):
+    def updateVacuum(self, status):
         #VACUUM BOX
-        self.window.prevacPressure.setText(  f'{self.ursapq.preVacPressure:.2e}')
-        self.window.chamberPressure.setText( f'{self.ursapq.chamberPressure:.2e}') 
-        self.window.pump_speed.setText( f'{self.ursapq.pump_speed}' )
+        self.window.prevacPressure.setText(  f'{status.preVacPressure:.2e}')
+        self.window.chamberPressure.setText( f'{status.chamberPressure:.2e}') 
+        self.window.pump_speed.setText( f'{status.pump_speed}' )
 
         self.window.prevacValves.setText( '{} ({})'.format(
-                                           "Open" if self.ursapq.preVacValve_isOpen else "Closed",
-                                           "Locked" if self.ursapq.preVacValve_lock else "Auto" ))
-        if not self.ursapq.pumps_areON:
+                                           "Open" if status.preVacValve_isOpen else "Closed",
+                                           "Locked" if status.preVacValve_lock else "Auto" ))
+        if not status.pumps_areON:
             pump_status = "Stop"
-        elif self.ursapq.pumps_normalOp:
+        elif status.pumps_normalOp:
             pump_status = "Running"
         else:
             pump_status = "Starting"
 
         self.window.pumpStatus.setText(  '{} ({})'.format( 
                                           pump_status,
-                                          "Auto" if self.ursapq.pumps_enable else "Locked" ))
+                                          "Auto" if status.pumps_enable else "Locked" ))
         #Update status label
-        if self.ursapq.preVac_OK:
+        if status.preVac_OK:
             self.window.vacuum_SL.setStyleSheet(BG_COLOR_WARNING)
         else:
-            if self.ursapq.pumps_enable:
+            if status.pumps_enable:
                 self.window.vacuum_SL.setStyleSheet(BG_COLOR_ERROR)
             else:
                 self.window.vacuum_SL.setStyleSheet(BG_COLOR_OFF)
 
-        if self.ursapq.preVac_OK and self.ursapq.mainVac_OK:
+        if status.preVac_OK and status.mainVac_OK:
             self.window.vacuum_SL.setStyleSheet(BG_COLOR_OK)
 
-    def updateSample(self):
-        self.window.bodyTemp.setText( '{:.1f}'.format(self.ursapq.sample_bodyTemp) )
-        self.window.capTemp.setText(  '{:.1f}'.format(self.ursapq.sample_capTemp) )
-        self.window.tipTemp.setText(  '{:.1f}'.format(self.ursapq.sample_tipTemp) )
-        self.window.gasLine_flow.setText('{:.0%}'.format(self.ursapq.gasLine_flow))
-        self.window.gasLine_pressure.setText('{:.2e}'.format(self.ursapq.gasLine_pressure))
+    def updateSample(self, status):
+        self.window.bodyTemp.setText( '{:.1f}'.format(status.sample_bodyTemp) )
+        self.window.capTemp.setText(  '{:.1f}'.format(status.sample_capTemp) )
+        self.window.tipTemp.setText(  '{:.1f}'.format(status.sample_tipTemp) )
+        self.window.gasLine_flow.setText('{:.0%}'.format(status.gasLine_flow))
+        self.window.gasLine_pressure.setText('{:.2e}'.format(status.gasLine_pressure))
 
         #Update status label
-        self.window.ovenStatus.setText(self.ursapq.oven_PIDStatus)
+        self.window.ovenStatus.setText(status.oven_PIDStatus)
 
-        if self.ursapq.oven_PIDStatus == "OK":
+        if status.oven_PIDStatus == "OK":
             self.window.sample_SL.setStyleSheet(BG_COLOR_OK)
-        elif self.ursapq.oven_PIDStatus == "TRACKING":
+        elif status.oven_PIDStatus == "TRACKING":
             self.window.sample_SL.setStyleSheet(BG_COLOR_WARNING)
-        elif self.ursapq.oven_PIDStatus == "OFF":
+        elif status.oven_PIDStatus == "OFF":
             self.window.sample_SL.setStyleSheet(BG_COLOR_OFF)
         else:
             self.window.sample_SL.setStyleSheet(BG_COLOR_ERROR)
 
-    def updateSpectrometer(self):
-        self.window.mcpFront_act.setText( '{:.1f}'.format(self.ursapq.mcp_frontHV))
-        self.window.mcpBack_act.setText(  '{:.1f}'.format(self.ursapq.mcp_backHV))
-        self.window.mcpPhos_act.setText(  '{:.1f}'.format(self.ursapq.mcp_phosphorHV))
-        self.window.magnet_temp.setText(  '{:.1f}'.format(self.ursapq.magnet_temp))
-        self.window.retarder.setText(  '{:.1f}'.format(self.ursapq.tof_retarderHV))
-        self.window.coil_curr.setText(  '{:.0f}'.format(self.ursapq.coil_current))
+    def updateSpectrometer(self, status):
+        self.window.mcpFront_act.setText( '{:.1f}'.format(status.mcp_frontHV))
+        self.window.mcpBack_act.setText(  '{:.1f}'.format(status.mcp_backHV))
+        self.window.mcpPhos_act.setText(  '{:.1f}'.format(status.mcp_phosphorHV))
+        self.window.magnet_temp.setText(  '{:.1f}'.format(status.magnet_temp))
+        self.window.retarder.setText(  '{:.1f}'.format(status.tof_retarderHV))
+        self.window.coil_curr.setText(  '{:.0f}'.format(status.coil_current))
 
-        if self.ursapq.HV_Status == 'OFF':
+        if status.HV_Status == 'OFF':
             self.window.detector_SL.setStyleSheet(BG_COLOR_OFF)
-        elif self.ursapq.HV_Status == 'WARNING':
+        elif status.HV_Status == 'WARNING':
             self.window.detector_SL.setStyleSheet(BG_COLOR_WARNING)
-        elif self.ursapq.HV_Status == 'OK':
-            if self.ursapq.coil_enable:
+        elif status.HV_Status == 'OK':
+            if status.coil_enable:
                 self.window.detector_SL.setStyleSheet(BG_COLOR_OK)
             else:
                 self.window.detector_SL.setStyleSheet(BG_COLOR_WARNING)
@@ -446,10 +463,11 @@ class MainWindow(ConsoleWindow):
 
     def update(self):
         try:
-            self.updateVacuum()
-            self.updateSample()
-            self.updateSpectrometer()
-            self.updateManipulator()
+            status = self.ursapq.snapshot() # Single request for all values
+            self.updateVacuum(status)
+            self.updateSample(status)
+            self.updateSpectrometer(status)
+            self.updateManipulator(status)
         except Exception as e:
             try:
                 self.connect()
@@ -461,9 +479,9 @@ class MainWindow(ConsoleWindow):
             statusbar = "NOT CONNECTED - Server off/restarted?"
 
         else:
-            lastStatusMessage = self.ursapq.lastStatusMessage.strftime("%H:%M:%S")
-            message = lastStatusMessage + " - " + self.ursapq.statusMessage
-            update =  'Last update: %s' % self.ursapq.lastUpdate.strftime("%d-%m-%y %H:%M:%S")
+            lastStatusMessage = status.lastStatusMessage.strftime("%H:%M:%S")
+            message = lastStatusMessage + " - " + status.statusMessage
+            update =  'Last update: %s' % status.lastUpdate.strftime("%d-%m-%y %H:%M:%S")
             statusbar = update + " | " + message
             self.window.statusBar().setStyleSheet(BG_COLOR_WHITE)
 
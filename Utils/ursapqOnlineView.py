@@ -91,10 +91,12 @@ class SingleShot:
         self.diff_ax = self.figure.add_subplot(gs[1,:], sharex=self.slice_ax)         
         
         data = ursapq.data_shots_filtered
+        self.axisVersion = None
+        axis = self.getAxis()
 
-        self.evenSlice, = self.slice_ax.plot( ursapq.data_axis[self.axId], data[0], label = 'even')
-        self.oddSlice,  = self.slice_ax.plot( ursapq.data_axis[self.axId], data[1], label = 'odd' )
-        self.diffSlice, = self.diff_ax.plot(  ursapq.data_axis[self.axId], data[0] - data[1], label='even+odd')
+        self.evenSlice, = self.slice_ax.plot( axis, data[0], label = 'even')
+        self.oddSlice,  = self.slice_ax.plot( axis, data[1], label = 'odd' )
+        self.diffSlice, = self.diff_ax.plot(  axis, data[0] - data[1], label='even+odd')
         self.diff_ax.axhline(0, color='black', linestyle=':', alpha=0.9, linewidth=0.9)
         self.slice_ax.legend()
         self.diff_ax.legend(loc='upper right')
@@ -106,6 +108,14 @@ class SingleShot:
 
         self.figure.show()
 
+    def getAxis(self):
+        ''' x-axis of the plots, fetched again only when data_axis_version changes '''
+        version = ursapq.data_axis_version
+        if version != self.axisVersion:
+            self.axis = np.array(ursapq.data_axis[self.axId])
+            self.axisVersion = version
+        return self.axis
+
     def init_autoscale(self):
         self.axbutton = self.figure.add_axes([0.8, 0.018, 0.16, 0.055])
         self.autoscale_button = Button(self.axbutton, 'Autoscale y')
@@ -176,9 +186,10 @@ class SingleShot:
         self.delay_text = self.delay_axis.text(curr_delay, 1.1, f"{curr_delay:.3f} ps", ha='center', fontfamily='monospace', fontsize='medium')
         self.delay_line = self.delay_axis.axvline(curr_delay, color='red', linewidth=2.2)
 
-        self.evenSlice.set_data( ursapq.data_axis[self.axId], data[0] )
-        self.oddSlice.set_data(  ursapq.data_axis[self.axId], data[1]  )
-        self.diffSlice.set_data( ursapq.data_axis[self.axId], data[0] + data[1])
+        axis = self.getAxis()
+        self.evenSlice.set_data( axis, data[0] )
+        self.oddSlice.set_data(  axis, data[1]  )
+        self.diffSlice.set_data( axis, data[0] + data[1])
 
         self.figure.canvas.draw()
         self.figure.canvas.flush_events()
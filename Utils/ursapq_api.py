@@ -1,17 +1,233 @@
 from multiprocessing.managers import BaseManager, NamespaceProxy
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Client
+import threading
+import asyncio
+import time
 import json
 import os
+import weakref
 from collections import namedtuple
+import numpy as np
 
 # Load config
 def _json_object_hook(d): return namedtuple('X', d.keys())(*d.values())
 def json2obj(filename): return json.load(filename, object_hook=_json_object_hook)
 
+# URSAPQ_CONFIG selects another config file, relative to this folder (e.g. config.simulation.json)
 local_dir = os.path.dirname(os.path.abspath(__file__))
-file = open(local_dir + '/config.json', 'r')
+file = open(os.path.join(local_dir, os.environ.get('URSAPQ_CONFIG', 'config.json')), 'r')
 config = json2obj(file)
 file.close()
 
+# Layout of the shared memory segments used by the data handler, must match Modules/sharedArrays.py
+SHM_HEADER_SIZE = 64
+
+class SharedArrayReader:
+    '''
+    Maps the arrays that the data handler publishes in shared memory (Data_SharedMemory config
+    option). The status namespace only contains a metadata dict for these arrays; the data
+    is read directly from the segment without copying, so it only works on the same host as
+    the data handler. The returned arrays are views: they are overwritten after a few data
+    updates, copy them if they need to be kept.
+
+    The segments of a key are closed when the data handler moves it to a new ring of segments
+    (new shape, or data handler restarted), or later if arrays returned before still use them:
+    closing unmaps the segment, which would leave those arrays pointing to freed memory.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.segments = {}
+        self.rings = {}   # Ring of segments of each key, segment names are <ring>_<slot>
+        self.views = {}   # Weak references to the _SegmentView of the arrays returned, by segment name
+        self.stale = []   # Names of the segments no longer published, still used by returned arrays
+
+    @staticmethod
+    def isShared(value):
+        return isinstance(value, dict) and 'shm' in value
+
+    def _attach(self, name):
+        try:
+            seg = shared_memory.SharedMemory(name, track=False)
+        except TypeError: # python < 3.13, untrack by hand or the segment is unlinked when we exit
+            seg = shared_memory.SharedMemory(name)
+            resource_tracker.unregister(seg._name, 'shared_memory')
+        return seg
+
+    def _inUse(self, name):
+        self.views[name] = [view for view in self.views.get(name, []) if view() is not None]
+        return bool(self.views[name])
+
+    def _closeUnused(self):
+        ''' Closes the stale segments that no returned array uses anymore '''
+        for name in list(self.stale):
+            if not self._inUse(name):
+                self.segments.pop(name).close()
+                self.views.pop(name)
+                self.stale.remove(name)
+
+    def map(self, key, info):
+        ''' Returns the array of key described by info, or None if it has been overwritten since '''
+        with self.lock:
+            return self._map(key, info)
+
+    def _map(self, key, info):
+        ring = info['shm'].rsplit('_', 1)[0]
+        if self.rings.get(key, ring) != ring:
+            self.stale += [name for name in self.segments if name.startswith(self.rings[key] + '_')]
+        self.rings[key] = ring
+        if self.stale:
+            self._closeUnused()
+
+        seg = self.segments.get(info['shm'])
+        if seg is None:
+            try:
+                seg = self.segments[info['shm']] = self._attach(info['shm'])
+            except FileNotFoundError:
+                raise Exception("Array is published in shared memory, it can only be read on the data handler host")
+
+        header = np.ndarray((1,), '<u8', buffer=seg.buf)
+        if header[0] != info['seq']:
+            return None
+        view = _SegmentView(seg, info)
+        self._inUse(info['shm']) # Drops the references to dead views
+        self.views[info['shm']].append(weakref.ref(view))
+        return np.asarray(view)
+
+class _SegmentView:
+    '''
+    Base of the arrays returned by SharedArrayReader. numpy keeps it referenced by the returned
+    array and by all arrays derived from it, so it lives as long as any of them uses the segment
+    '''
+    def __init__(self, seg, info):
+        address = np.frombuffer(seg.buf, np.uint8).ctypes.data
+        self.__array_interface__ = {'shape'  : tuple(info['shape']),
+                                    'typestr': info['dtype'],
+                                    'data'   : (address + SHM_HEADER_SIZE, False),
+                                    'version': 3}
+
+
+class StatusProxy(NamespaceProxy):
+    # Must match the server side proxy in Modules/sharedNamespace.py
+    _exposed_ = ('__getattribute__', '__setattr__', '__delattr__', 'snapshot', 'update')
+
+    def snapshot(self, keys=None):
+        return self._callmethod('snapshot', (keys,))
+
+    def update(self, values):
+        return self._callmethod('update', (values,))
+
+class StatusSnapshot:
+    '''
+    Read only view of the status at the time of an UrsaPQ.snapshot() call.
+    Values are accessed as attributes (or items), like on UrsaPQ itself.
+    '''
+    def __init__(self, values):
+        super(StatusSnapshot, self).__setattr__('_values', values)
+
+    def __getattr__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __setattr__(self, key, val):
+        raise AttributeError("Status snapshots are read only")
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def asdict(self):
+        return dict(self._values)
+
+    def __repr__(self):
+        return f"StatusSnapshot({self._values})"
+
+StatusEvent = namedtuple('StatusEvent', ['key', 'value', 'timestamp', 'seq'])
+
+class StatusSubscription:
+    '''
+    Receives status change events pushed by the manager for the given keys (None for all keys).
+    Events are StatusEvent tuples: (key, value, timestamp, seq), seq increases with every change.
+    Events of the data_* analysis outputs have no value (None), read them when needed. keys=None
+    subscribes to all keys except data_*.
+
+    If callback is given, it is called for each event from a background thread. Otherwise
+    events are read by iterating on the subscription, either with a plain for loop or with
+    async for, or one at a time with get()/aget(). Use close() (or a with block) to stop the
+    subscription. All changes after the constructor returns are received.
+    '''
+    def __init__(self, keys, callback=None):
+        port = getattr(config, 'UrsapqServer_EventPort', None)
+        if port is None:
+            raise Exception("Events not available, add UrsapqServer_EventPort to config file")
+        self.conn = Client((config.UrsapqServer_IP, port), authkey=config.UrsapqServer_AuthKey.encode('ascii'))
+        self.conn.send(None if keys is None else list(keys))
+
+        # Wait for the manager to register the subscription (sharedNamespace.SUBSCRIBED)
+        if not self.conn.poll(5) or self.conn.recv() != 'subscribed':
+            self.conn.close()
+            raise TimeoutError("Manager did not acknowledge the event subscription")
+        self.callback = callback
+
+        if callback is not None:
+            threading.Thread(target=self._callbackLoop, daemon=True).start()
+
+    def _recv(self):
+        try:
+            return StatusEvent(*self.conn.recv())
+        except (EOFError, OSError, TypeError): # TypeError if close() was called while receiving
+            return None
+
+    def _callbackLoop(self):
+        while True:
+            event = self._recv()
+            if event is None:
+                return
+            self.callback(*event)
+
+    def get(self, timeout=None):
+        ''' Returns the next event, or None if there is none within timeout seconds '''
+        if not self.conn.poll(timeout):
+            return None
+        event = self._recv()
+        if event is None:
+            raise EOFError("Event connection closed by the manager")
+        return event
+
+    async def aget(self, timeout=None):
+        ''' Same as get(), for async code '''
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, timeout)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        event = self._recv()
+        if event is None:
+            raise StopIteration
+        return event
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await asyncio.get_running_loop().run_in_executor(None, self._recv)
+        if event is None:
+            raise StopAsyncIteration
+        return event
 
 class UrsaPQ:
     '''
@@ -20,15 +236,19 @@ class UrsaPQ:
 
     Examples:
     exp = UrsaPQ()
-    print( exp.ovenEnable ) # prints oven enable status
-    exp.ovenEnable = True   # tries to enable oven, might not succeed
-                            # check exp.ovenEnable to test
+    print( exp.oven_enable ) # prints oven enable status
+    exp.oven_enable = True   # tries to enable oven, might not succeed
+                             # check exp.oven_enable to test
 
     print( exp.chamberPressure ) # prints chamberPressure
     exp.chamberPressure = 1      # no effect, chamberPressure is read only.
 
     For a full list of available parameters, see ursapqManager.py or just use:
     print(exp)
+
+    Each attribute access is a separate request to the manager. To read many values at once use:
+    status = exp.snapshot()
+    print( status.chamberPressure, status.oven_enable )
     '''
 
     def __init__(self):
@@ -36,7 +256,7 @@ class UrsaPQ:
         # representing the status. (see multiprocessing.Manager)
 
         class statusManager(BaseManager): pass
-        statusManager.register('getStatusNamespace', proxytype=NamespaceProxy)
+        statusManager.register('getStatusNamespace', proxytype=StatusProxy)
 
         super(UrsaPQ, self).__setattr__('_manager', statusManager((config.UrsapqServer_IP,
                                                                    config.UrsapqServer_Port),
@@ -60,9 +280,101 @@ class UrsaPQ:
         except Exception:
             super(UrsaPQ, self).__setattr__('_writeStatus', None )
 
+        super(UrsaPQ, self).__setattr__('_sharedArrays', SharedArrayReader() )
+
     def __getattr__(self, key):
         # Attribute lookup is passed on directly to the status namespace
-        return self._status.__getattr__(key)
+        value = self._status.__getattr__(key)
+
+        return self._mapShared(key, value, lambda: self._status.__getattr__(key))
+
+    def _mapShared(self, key, value, refetch):
+        # Arrays published in shared memory are mapped, if the slot was overwritten
+        # between reading the metadata and mapping it, try again with fresh metadata
+        for i in range(3):
+            if not self._sharedArrays.isShared(value):
+                return value
+            array = self._sharedArrays.map(key, value)
+            if array is not None:
+                return array
+            value = refetch()
+        raise Exception(f"Cannot map {key}, data is updating too fast")
+
+    def snapshot(self, keys=None):
+        '''
+        Returns a read only view (StatusSnapshot) of many status values, fetched in a single
+        request to the manager. The values are coherent: they are never taken halfway through
+        a manager status update.
+        keys is a list of status names, if None all values are returned except the data_* 
+        analysis outputs, which can be large and must be requested explicitly.
+        '''
+        values = self._status.snapshot(None if keys is None else list(keys))
+        for key, value in values.items():
+            values[key] = self._mapShared(key, value, lambda: self._status.__getattr__(key))
+        return StatusSnapshot(values)
+
+    def subscribe(self, keys, callback):
+        '''
+        Calls callback(key, value, timestamp, seq) from a background thread every time one of
+        the status values in keys changes (all values except data_* if keys is None). Returns the
+        StatusSubscription, close it to stop receiving events. data_* events have no value.
+        Requires UrsapqServer_EventPort in the config file.
+        '''
+        return StatusSubscription(keys, callback)
+
+    def events(self, keys):
+        '''
+        Returns a StatusSubscription to iterate on the changes of keys, eg:
+        with exp.events(['tof_retarderHV']) as events:
+            async for event in events:
+                print(event.value)
+        '''
+        return StatusSubscription(keys)
+
+    @property
+    def eventsEnabled(self):
+        ''' True if the config file sets UrsapqServer_EventPort, needed by subscribe() and events() '''
+        return getattr(config, 'UrsapqServer_EventPort', None) is not None
+
+    def watch(self, key, period=1):
+        '''
+        Yields the value of key now, then every time it changes and at least every period seconds
+        (so a steady value is yielded again). Waits for change events if the config has an event
+        port, otherwise polls every period seconds. E.g.:
+        for rate in exp.watch('gmd_rate', 10):
+            ...
+        '''
+        if not self.eventsEnabled:
+            while True:
+                yield self.__getattr__(key)
+                time.sleep(period)
+
+        with self.events([key]) as events:
+            value = self.__getattr__(key)
+            while True:
+                yield value
+                event = events.get(period)
+                value = self._watchedValue(key, event)
+
+    async def awatch(self, key, period=1):
+        ''' Same as watch(), for async code: async for value in exp.awatch(key) '''
+        if not self.eventsEnabled:
+            while True:
+                yield self.__getattr__(key)
+                await asyncio.sleep(period)
+
+        with self.events([key]) as events:
+            value = self.__getattr__(key)
+            while True:
+                yield value
+                event = await events.aget(period)
+                value = self._watchedValue(key, event)
+
+    def _watchedValue(self, key, event):
+        # The pushed value, read again if there was no event within the period or events of key have no value (data_*)
+        if event is None or key.startswith('data_'):
+            return self.__getattr__(key)
+        return event.value
 
     def __setattr__(self, key, val):
         # Attribute setting is done by setting the variable in the writeStatus